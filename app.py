@@ -1,6 +1,9 @@
-from app import app, db
+from werkzeug.local import LocalProxy
+from app import create_app, db
 from app.models import User
 
+app = create_app()
+
 @app.shell_context_processor
 def make_shell_context():
-    return {'db': db, 'User': User, 'users':User.query.all()}
+    return {'db': db, 'User': User, 'users': LocalProxy(lambda: User.query.all())}
@@ -1,25 +1,124 @@
 import os
-import sentry_sdk
-from flask import Flask
+import click
+from flask import Flask, Blueprint
+from jinja2 import FileSystemBytecodeCache
 from config import Config
-from sqlalchemy import MetaData
+from sqlalchemy import MetaData, event
 from flask_sqlalchemy import SQLAlchemy
-from flask_migrate import Migrate
 from flask_login import LoginManager, current_user
 import logging
 from logging.handlers import SMTPHandler, RotatingFileHandler
 from flask_bootstrap import Bootstrap
 from flask_hcaptcha import hCaptcha
+from flask_limiter import Limiter
+from flask_limiter.util import get_remote_address
+from app.limit_storage import SQLiteStorage  # registers sqlite:// for RATELIMIT_STORAGE_URI
 from functools import wraps
 
-app = Flask(__name__)
-app.config.from_object(Config)
-db = SQLAlchemy(app)
-migrate = Migrate(app, db, render_as_batch=True, compare_type=True)
-login = LoginManager(app)
-login.login_view = 'login'
-bootstrap = Bootstrap(app)
-hcaptcha = hCaptcha(app)
-
-from app import routes, models, errors
-login.login_message = u'Please sign in to access this page.'
\ No newline at end of file
+db = SQLAlchemy()
+login = LoginManager()
+login.login_view = 'main.login'
+login.login_message = u'Please sign in to access this page.'
+bootstrap = Bootstrap()
+hcaptcha = hCaptcha()
+limiter = Limiter(get_remote_address)
+# Views, hooks, template globals and CLI commands register here;
+# create_app() registers it on each app it builds.
+bp = Blueprint('main', __name__, cli_group=None)
+
+
+class LazyGroup(click.Group):
+    """
+        CLI group whose real commands come from `load()` on first use, so
+        their imports are only paid for by the commands that need them.
+    """
+
+    def __init__(self, name, load, **kwargs):
+        super().__init__(name, **kwargs)
+        self.load = load
+        self.group = None
+
+    def resolve(self):
+        if self.group is None:
+            self.group = self.load()
+        return self.group
+
+    def list_commands(self, ctx):
+        return self.resolve().list_commands(ctx)
+
+    def get_command(self, ctx, name):
+        return self.resolve().get_command(ctx, name)
+
+
+def migrate_commands(app):
+    def load():
+        from flask_migrate import Migrate
+        from flask_migrate.cli import db as db_group
+        Migrate(app, db, render_as_batch=True, compare_type=True)
+        return db_group
+    return LazyGroup('db', load, help='Perform database migrations.')
+
+
+def sqlite_pragmas(pragmas):
+    """Connect listener that applies `pragmas` to each new SQLite connection."""
+    def connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute('PRAGMA {}={}'.format(name, value))
+        cursor.close()
+    return connect
+
+
+def create_app(config_class=Config):
+    """
+        Build the Flask app and bind the extensions to it. Flask-Migrate
+        (and alembic) are only imported when a 'flask db' command runs.
+        Compiled templates are shared between workers through
+        JINJA_CACHE_DIR, and DATABASE_MODE=production applies
+        SQLITE_PRAGMAS (WAL etc.) to every SQLite connection. Each call
+        returns a fully wired app: the views come from the `main`
+        blueprint, and the asset manifest, sidecar scan, page cache and
+        engine hooks are built for that app alone.
+    """
+    app = Flask(__name__)
+    app.config.from_object(config_class)
+    if app.config['JINJA_CACHE_DIR']:
+        os.makedirs(app.config['JINJA_CACHE_DIR'], exist_ok=True)
+        app.jinja_options = dict(app.jinja_options,
+            bytecode_cache=FileSystemBytecodeCache(app.config['JINJA_CACHE_DIR']))
+    db.init_app(app)
+    if app.config['SQLITE_PRAGMAS']:
+        with app.app_context():
+            if db.engine.dialect.name == 'sqlite':
+                event.listen(db.engine, 'connect', sqlite_pragmas(app.config['SQLITE_PRAGMAS']))
+    login.init_app(app)
+    bootstrap.init_app(app)
+    hcaptcha.init_app(app)
+    limiter.init_app(app)
+    app.cli.add_command(migrate_commands(app))
+
+    from app import routes, models, errors, assets, outbox, broadcast, user_cache, sitemap, \
+        compression, images, styles, critical, prewarm, bulk_users, last_seen, parents, \
+        passwords, search, rate_limits, captcha, metrics, query_log, page_cache
+    app.register_blueprint(bp)
+    passwords.hasher.init_app(app)
+    user_cache.user_cache.init_app(app)
+    parents.parent_choices.init_app(app)
+    last_seen.last_seen.init_app(app)
+    outbox.worker.init_app(app)
+    sitemap.init_app(app)
+    rate_limits.shed_load.init_app(app)
+    captcha.captcha.init_app(app)
+    assets.init_app(app)
+    compression.init_app(app)
+    critical.init_app(app)
+    images.init_app(app)
+    page_cache.init_app(app)
+    metrics.init_app(app)
+    query_log.query_log.init_app(app)
+
+    if app.config['SITEMAP_HOSTS']:
+        sitemap.build_sitemaps(app, app.config['SITEMAP_HOSTS'])
+    if app.config['PREWARM']:
+        prewarm.prewarm(app)
+    return app
@@ -0,0 +1,158 @@
+import os
+import json
+import hashlib
+import click
+from flask import url_for, current_app
+from app import bp
+from app.compression import send_static, write_sidecars, ENCODINGS
+
+
+class AssetManifest(object):
+    """
+        Maps each file under the static folder to a content-hashed name so
+        templates can link to URLs that never change for a given file body.
+        The mapping is built once (or loaded from a prebuilt JSON file) and
+        renders only do dict lookups. Files under `prehashed` directories
+        already carry a content hash in their name and map to themselves,
+        and `aliases` point a source name at a built file (e.g. the purged
+        stylesheet for css/custom.css).
+    """
+
+    def __init__(self, static_folder, exclude=(), prehashed=()):
+        self.static_folder = static_folder
+        self.exclude = tuple(exclude)
+        self.prehashed = tuple(prehashed)
+        self.aliases = {}
+        self.assets = {}
+        self.originals = {}
+
+    def build(self):
+        assets = {}
+        for root_path, dirs, files in os.walk(self.static_folder):
+            rel_dir = os.path.relpath(root_path, self.static_folder)
+            if rel_dir == '.':
+                rel_dir = ''
+            dirs[:] = [d for d in dirs
+                       if os.path.join(rel_dir, d).replace(os.sep, '/') not in self.exclude]
+            for f in files:
+                if f.endswith(('.gz', '.br')):
+                    continue
+                filename = os.path.join(rel_dir, f).replace(os.sep, '/')
+                if filename.startswith(tuple(d + '/' for d in self.prehashed)):
+                    assets[filename] = filename
+                else:
+                    assets[filename] = hashed_name(filename,
+                        file_digest(os.path.join(root_path, f)))
+        self.set_assets(assets)
+        return self
+
+    def set_assets(self, assets):
+        self.assets = assets
+        self.originals = {v: k for k, v in assets.items()}
+
+    def load(self, path):
+        with open(path) as f:
+            self.set_assets(json.load(f))
+        return self
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.assets, f, indent=2, sort_keys=True)
+
+    def load_aliases(self, path):
+        with open(path) as f:
+            self.aliases = json.load(f)
+        return self
+
+    def hashed(self, filename):
+        return self.assets.get(self.aliases.get(filename, filename))
+
+    def original(self, hashed_filename):
+        return self.originals.get(hashed_filename)
+
+
+def file_digest(path, length=10):
+    digest = hashlib.md5()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(65536), b''):
+            digest.update(chunk)
+    return digest.hexdigest()[:length]
+
+
+def hashed_name(filename, digest):
+    base, ext = os.path.splitext(filename)
+    return base + '.' + digest + ext
+
+
+def init_manifest(app):
+    manifest = AssetManifest(app.static_folder, app.config['ASSET_MANIFEST_EXCLUDE'],
+                             app.config['ASSET_PREHASHED'])
+    path = app.config['ASSET_MANIFEST']
+    if path and os.path.exists(path) and not app.debug:
+        manifest.load(path)
+    else:
+        manifest.build()
+    aliases = app.config['ASSET_ALIASES']
+    if aliases and os.path.exists(aliases) and not app.debug:
+        manifest.load_aliases(aliases)
+    return manifest
+
+
+def init_app(app):
+    app.extensions['asset_manifest'] = init_manifest(app)
+
+
+def current_manifest():
+    return current_app.extensions['asset_manifest']
+
+
+@bp.app_template_global()
+def asset_url(filename, **values):
+    """
+        url_for('static', ...) replacement that links to the content-hashed
+        copy of a static file. Unknown files fall back to the plain static URL.
+    """
+    hashed = current_manifest().hashed(filename)
+    if hashed is None:
+        return url_for('static', filename=filename, **values)
+    return url_for('main.hashed_static', filename=hashed, **values)
+
+
+@bp.route('/assets/<path:filename>')
+def hashed_static(filename):
+    original = current_manifest().original(filename)
+    if original is None:
+        # Relative references inside stylesheets (e.g. url(../img/...)) resolve
+        # against /assets/ with their plain names, so serve those uncached.
+        return send_static(filename)
+    response = send_static(original, max_age=current_app.config['ASSET_MAX_AGE'])
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+@bp.cli.group()
+def assets():
+    """Static asset commands."""
+    pass
+
+
+@assets.command('build')
+def build_manifest():
+    """Hash static files and write the asset manifest."""
+    path = current_app.config['ASSET_MANIFEST']
+    if not path:
+        raise click.UsageError('ASSET_MANIFEST is not configured.')
+    built = AssetManifest(current_app.static_folder, current_app.config['ASSET_MANIFEST_EXCLUDE'],
+                          current_app.config['ASSET_PREHASHED']).build()
+    built.save(path)
+    click.echo('Wrote ' + str(len(built.assets)) + ' assets to ' + path)
+
+
+@assets.command('compress')
+def compress_assets():
+    """Write precompressed sidecars for static files."""
+    count, before, after = write_sidecars(current_app.static_folder,
+                                          current_app.config['ASSET_MANIFEST_EXCLUDE'])
+    click.echo('Compressed ' + str(count) + ' files: ' + str(before) + ' -> ' +
+               str(after) + ' bytes gzipped (' + ', '.join(ENCODINGS) + ')')
@@ -0,0 +1,202 @@
+import json
+import threading
+import click
+from time import monotonic
+from flask import render_template, current_app
+from sqlalchemy import select, insert
+from app import bp, db
+from app.models import User, OutboxMessage
+from app.email import mail_transport, mailjet_message
+from app.outbox import RETRY_STATUSES, worker
+
+
+class Broadcast(object):
+    """
+        Emails a segment of users. Recipients are streamed from the database
+        in batches (yield_per, i.e. a server-side cursor where the driver
+        supports one), the HTML is rendered once with Mailjet template
+        variables for per-user fields, and each batch is submitted in API
+        calls of up to MAILJET_BATCH_SIZE messages. Messages that fail with a
+        retryable status are handed to the outbox after each batch, on a
+        connection of their own so the cursor's session is left alone. After
+        max_failures API calls in a row fail outright the run stops; start
+        another with after_id=last_id to pick up where it left off.
+    """
+
+    def __init__(self, subject, message, role=None, status=None, batch_size=500,
+                 max_failures=3, after_id=None):
+        self.subject = subject
+        self.message = message
+        self.role = role
+        self.status = status
+        self.batch_size = batch_size
+        self.max_failures = max_failures
+        self.after_id = after_id
+        self.last_id = after_id
+        self.recipients = 0
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.batches = 0
+        self.started = None
+        self.finished = None
+        self.error = None
+        self.failed_calls = 0
+
+    def query(self, after_id=None):
+        q = select(User.id, User.first_name, User.last_name, User.email) \
+            .where(User.email != None).order_by(User.id)
+        if self.role:
+            q = q.where(User.role == self.role)
+        if self.status:
+            q = q.where(User.status == self.status)
+        if after_id:
+            q = q.where(User.id > after_id)
+        return q
+
+    def recipient_batches(self):
+        """
+            Recipients in lists of up to batch_size. SQLite has no server-side
+            cursor, and a read left open there would lock out the outbox
+            inserts, so it is paged by id instead.
+        """
+        if db.engine.dialect.name != 'sqlite':
+            yield from db.session.execute(
+                self.query(self.after_id).execution_options(yield_per=self.batch_size)
+            ).partitions()
+            return
+        after_id = self.after_id
+        while True:
+            rows = db.session.execute(self.query(after_id).limit(self.batch_size)).all()
+            if not rows:
+                return
+            yield rows
+            after_id = rows[-1].id
+
+    def message_for(self, html, user):
+        message = mailjet_message(user.email, self.subject, html)
+        message["TemplateLanguage"] = True
+        message["Variables"] = {
+            "first_name": user.first_name or '',
+            "last_name": user.last_name or '',
+        }
+        return message
+
+    def run(self):
+        self.started = monotonic()
+        html = render_template('email/broadcast-email.html', message=self.message)
+        size = current_app.config['MAILJET_BATCH_SIZE']
+        transport = mail_transport()
+        try:
+            for rows in self.recipient_batches():
+                self.batches += 1
+                retries = []
+                for i in range(0, len(rows), size):
+                    chunk = rows[i:i + size]
+                    messages = [self.message_for(html, u) for u in chunk]
+                    retries += self.record(messages, transport.send(messages))
+                    self.recipients += len(chunk)
+                    self.last_id = chunk[-1].id
+                    if self.failed_calls >= self.max_failures:
+                        break
+                self.queue_retries(retries)
+                if self.failed_calls >= self.max_failures:
+                    self.error = 'Stopped after {} failed API calls in a row; resume after ' \
+                        'user {}'.format(self.failed_calls, self.last_id)
+                    current_app.logger.error('Broadcast: %s', self.error)
+                    break
+        except Exception as e:
+            self.error = repr(e)
+            current_app.logger.exception('Broadcast failed')
+        finally:
+            self.finished = monotonic()
+        current_app.logger.info('Broadcast finished: %s', self.stats())
+        return self
+
+    def record(self, messages, results):
+        """Count `results` and return the messages worth retrying."""
+        retries = []
+        for message, result in zip(messages, results):
+            if result.status == 200:
+                self.sent += 1
+            elif result.status is None or result.status in RETRY_STATUSES:
+                retries.append(message)
+            else:
+                self.failed += 1
+        if len(retries) == len(messages):
+            self.failed_calls += 1
+        else:
+            self.failed_calls = 0
+        return retries
+
+    def queue_retries(self, messages):
+        """Add `messages` to the outbox without touching the cursor's session."""
+        if not messages:
+            return
+        try:
+            with db.engine.begin() as connection:
+                connection.execute(insert(OutboxMessage), [
+                    {'kind': 'broadcast', 'recipient': m["To"][0]["Email"],
+                     'payload': json.dumps(m)} for m in messages])
+        except Exception:
+            current_app.logger.exception('Could not queue broadcast retries')
+            self.failed += len(messages)
+            return
+        self.retried += len(messages)
+        worker.notify()
+
+    def elapsed(self):
+        if self.started is None:
+            return 0
+        return (self.finished or monotonic()) - self.started
+
+    def stats(self):
+        elapsed = self.elapsed()
+        return {
+            'recipients': self.recipients,
+            'sent': self.sent,
+            'failed': self.failed,
+            'retried': self.retried,
+            'batches': self.batches,
+            'elapsed': round(elapsed, 2),
+            'per_second': round(self.sent / elapsed, 1) if elapsed else 0,
+            'running': self.started is not None and self.finished is None,
+            'last_id': self.last_id,
+            'error': self.error,
+        }
+
+
+last_broadcast = None
+
+
+def start_broadcast(broadcast):
+    """Run a broadcast on a background thread and remember it for status."""
+    global last_broadcast
+    last_broadcast = broadcast
+    broadcast.started = monotonic()
+
+    app = current_app._get_current_object()
+
+    def target():
+        with app.app_context():
+            broadcast.run()
+
+    threading.Thread(target=target, name='broadcast', daemon=True).start()
+    return broadcast
+
+
+@bp.cli.command('broadcast')
+@click.option('--subject', required=True)
+@click.option('--message-file', type=click.File(), required=True)
+@click.option('--role', default=None, help='Only users with this role.')
+@click.option('--status', default=None, help='Only users with this status.')
+@click.option('--batch-size', default=500, show_default=True)
+@click.option('--after-id', type=int, default=None,
+              help='Resume a stopped broadcast after this user id.')
+def broadcast_command(subject, message_file, role, status, batch_size, after_id):
+    """Email a segment of users and report throughput."""
+    broadcast = Broadcast(subject, message_file.read(), role=role, status=status,
+        batch_size=batch_size, max_failures=current_app.config['BROADCAST_MAX_FAILURES'],
+        after_id=after_id).run()
+    for key, value in broadcast.stats().items():
+        click.echo(key + ': ' + str(value))
@@ -0,0 +1,210 @@
+import os
+import csv
+import json
+import click
+from time import perf_counter
+from datetime import datetime
+from itertools import islice
+from sqlalchemy import select, insert, update, func
+from sqlalchemy.orm import aliased
+from app import bp, db
+from app.models import User
+from app.parents import parent_choices
+
+FIELDS = ['email', 'first_name', 'last_name', 'phone', 'location', 'status', 'role',
+          'parent_email', 'is_admin', 'is_verified', 'timestamp', 'last_viewed']
+IMPORT_FIELDS = [f for f in FIELDS if f not in ('email', 'parent_email')] + ['password_hash']
+BOOLEAN_FIELDS = ('is_admin', 'is_verified')
+DATETIME_FIELDS = ('timestamp', 'last_viewed')
+
+
+@bp.cli.group()
+def users():
+    """Bulk user import and export."""
+    pass
+
+
+def file_format(file, format):
+    if format:
+        return format
+    return 'jsonl' if os.path.splitext(file.name)[1] in ('.jsonl', '.json') else 'csv'
+
+
+def chunks(iterable, size):
+    iterator = iter(iterable)
+    chunk = list(islice(iterator, size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(iterator, size))
+
+
+class Progress(object):
+    def __init__(self, label):
+        self.label = label
+        self.count = 0
+        self.start = perf_counter()
+
+    def add(self, count):
+        self.count += count
+        click.echo(self.line(), err=True)
+
+    def line(self):
+        elapsed = perf_counter() - self.start
+        rate = self.count / elapsed if elapsed else 0
+        return '{} {} users ({:.0f}/s)'.format(self.label, self.count, rate)
+
+
+def export_rows(chunk_size, password_hashes=False):
+    parent = aliased(User)
+    columns = [parent.email.label(f) if f == 'parent_email' else getattr(User, f)
+               for f in FIELDS]
+    if password_hashes:
+        columns.append(User.password_hash)
+    query = (select(*columns).outerjoin(parent, User.parent_id == parent.id)
+             .order_by(User.id).execution_options(yield_per=chunk_size))
+    for row in db.session.execute(query):
+        values = row._asdict()
+        for f in DATETIME_FIELDS:
+            if values[f] is not None:
+                values[f] = values[f].isoformat()
+        yield values
+
+
+@users.command('export')
+@click.argument('output', type=click.File('w'), default='-')
+@click.option('--format', type=click.Choice(['csv', 'jsonl']), default=None,
+              help='Defaults to the file extension, else csv.')
+@click.option('--chunk-size', default=1000, show_default=True)
+@click.option('--password-hashes', is_flag=True, help='Include password hashes.')
+def export_users(output, format, chunk_size, password_hashes):
+    """Stream all users to OUTPUT (stdout by default)."""
+    fields = FIELDS + (['password_hash'] if password_hashes else [])
+    writer = None
+    if file_format(output, format) == 'csv':
+        writer = csv.DictWriter(output, fields)
+        writer.writeheader()
+    progress = Progress('Exported')
+    for chunk in chunks(export_rows(chunk_size, password_hashes), chunk_size):
+        for values in chunk:
+            if writer:
+                writer.writerow(values)
+            else:
+                output.write(json.dumps(values) + '\n')
+        progress.add(len(chunk))
+
+
+def read_rows(file, format):
+    if format == 'csv':
+        return csv.DictReader(file)
+    return (json.loads(line) for line in file if line.strip())
+
+
+def clean(row):
+    """
+        Normalise one input record into User column values plus the parent
+        email. Emails keep their casing; matching lowercases them.
+    """
+    values = {}
+    for f in IMPORT_FIELDS:
+        value = row.get(f)
+        if value is None or value == '':
+            continue
+        if f in BOOLEAN_FIELDS and isinstance(value, str):
+            value = value.strip().lower() in ('1', 'true', 'yes', 'y')
+        elif f in DATETIME_FIELDS and isinstance(value, str):
+            value = datetime.fromisoformat(value)
+        values[f] = value
+    values['email'] = (row.get('email') or '').strip()
+    return values, (row.get('parent_email') or '').strip().lower() or None
+
+
+class UserImport(object):
+    """
+        Upserts users by case-insensitive email one chunk at a time, keeping
+        the stored casing of existing emails: one SELECT to find
+        existing rows, one bulk INSERT, one executemany UPDATE, and one
+        more UPDATE for parent links. Parents that appear later in the file
+        are linked once the whole file has been read.
+    """
+
+    def __init__(self, update_existing=True):
+        self.update_existing = update_existing
+        self.inserted = 0
+        self.updated = 0
+        self.skipped = 0
+        self.pending_parents = []
+
+    def ids_for(self, emails):
+        """Map lowercased `emails` to the ids of the users that have them."""
+        if not emails:
+            return {}
+        email = func.lower(User.email)
+        return dict(db.session.execute(select(email, User.id).where(email.in_(emails))).all())
+
+    def load(self, rows):
+        records = {}
+        for row in rows:
+            values, parent_email = clean(row)
+            if not values['email']:
+                self.skipped += 1
+                continue
+            records[values['email'].lower()] = (values, parent_email)
+
+        existing = self.ids_for(list(records))
+        new = [values for email, (values, parent) in records.items() if email not in existing]
+        changed = [dict({f: v for f, v in values.items() if f != 'email'}, id=existing[email])
+                   for email, (values, parent) in records.items() if email in existing]
+        if new:
+            db.session.execute(insert(User), new)
+        if changed and self.update_existing:
+            db.session.execute(update(User), changed)
+        self.inserted += len(new)
+        self.updated += len(changed) if self.update_existing else 0
+        self.skipped += 0 if self.update_existing else len(changed)
+
+        links = [(email, parent) for email, (values, parent) in records.items()
+                 if parent and (email not in existing or self.update_existing)]
+        self.pending_parents.extend(self.link_parents(links))
+        db.session.commit()
+
+    def link_parents(self, links):
+        """Set parent_id for (email, parent email) pairs; returns the unresolved ones."""
+        if not links:
+            return []
+        ids = self.ids_for(list({e for link in links for e in link}))
+        resolved = [(email, parent) for email, parent in links if parent in ids]
+        if resolved:
+            db.session.execute(update(User), [{'id': ids[email], 'parent_id': ids[parent]}
+                                              for email, parent in resolved])
+        return [link for link in links if link[1] not in ids]
+
+    def finish(self, chunk_size):
+        unresolved = []
+        for chunk in chunks(self.pending_parents, chunk_size):
+            unresolved.extend(self.link_parents(chunk))
+            db.session.commit()
+        self.pending_parents = unresolved
+        parent_choices.invalidate()
+        return self
+
+
+@users.command('import')
+@click.argument('input', type=click.File('r'))
+@click.option('--format', type=click.Choice(['csv', 'jsonl']), default=None,
+              help='Defaults to the file extension, else csv.')
+@click.option('--chunk-size', default=1000, show_default=True)
+@click.option('--update/--no-update', 'update_existing', default=True, show_default=True,
+              help='Update users whose email already exists.')
+def import_users(input, format, chunk_size, update_existing):
+    """Insert or update users from a CSV or JSONL file, matched by email."""
+    job = UserImport(update_existing)
+    progress = Progress('Imported')
+    for chunk in chunks(read_rows(input, file_format(input, format)), chunk_size):
+        job.load(chunk)
+        progress.add(len(chunk))
+    job.finish(chunk_size)
+    click.echo('{} inserted, {} updated, {} skipped'.format(
+        job.inserted, job.updated, job.skipped))
+    if job.pending_parents:
+        click.echo('{} parent emails not found, e.g. {}'.format(
+            len(job.pending_parents), job.pending_parents[0][1]), err=True)
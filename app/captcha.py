@@ -0,0 +1,119 @@
+import threading
+import requests
+from time import monotonic
+from flask import request, current_app
+from requests.adapters import HTTPAdapter
+from app import hcaptcha
+from app.metrics import external_call
+
+
+class CircuitBreaker(object):
+    """
+        Opens after `threshold` consecutive failures and stays open for
+        `reset_timeout` seconds, then lets one trial call through
+        (half-open): success closes it again, failure reopens it.
+    """
+
+    def __init__(self, threshold=5, reset_timeout=30):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.lock = threading.Lock()
+        self.failures = 0
+        self.opened = None
+        self.trial = False
+
+    def allow(self):
+        with self.lock:
+            if self.opened is None:
+                return True
+            if not self.trial and monotonic() - self.opened >= self.reset_timeout:
+                self.trial = True
+                return True
+            return False
+
+    def success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened = None
+            self.trial = False
+
+    def failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.trial or self.failures >= self.threshold:
+                self.opened = monotonic()
+                self.trial = False
+
+    @property
+    def state(self):
+        with self.lock:
+            if self.opened is None:
+                return 'closed'
+            return 'half-open' if self.trial else 'open'
+
+
+class CaptchaVerifier(object):
+    """
+        hCaptcha siteverify client with a keep-alive session, a hard
+        timeout and a circuit breaker. When the API is slow, failing or
+        the breaker is open, verify() returns `fail_open` instead of
+        holding the worker.
+    """
+
+    def __init__(self, secret=None, verify_url=None, timeout=2.0, pool_size=10, fail_open=False,
+                 breaker=None):
+        self.secret = secret
+        self.verify_url = verify_url
+        self.timeout = timeout
+        self.fail_open = fail_open
+        self.breaker = breaker or CircuitBreaker()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.lock = threading.Lock()
+        self.counts = {'passed': 0, 'rejected': 0, 'errors': 0, 'short_circuited': 0}
+
+    def init_app(self, app):
+        self.secret = app.config['HCAPTCHA_SECRET_KEY']
+        self.verify_url = app.config['HCAPTCHA_VERIFY_URL']
+        self.timeout = app.config['HCAPTCHA_TIMEOUT']
+        self.fail_open = app.config['HCAPTCHA_FAIL_OPEN']
+        self.breaker = CircuitBreaker(app.config['HCAPTCHA_BREAKER_THRESHOLD'],
+                                      app.config['HCAPTCHA_BREAKER_RESET'])
+
+    def count(self, outcome):
+        with self.lock:
+            self.counts[outcome] += 1
+
+    def verify(self, response=None, remote_ip=None):
+        if not hcaptcha.is_enabled:
+            return True
+        if not self.breaker.allow():
+            self.count('short_circuited')
+            return self.fail_open
+        data = {'secret': self.secret,
+                'response': response or request.form.get('h-captcha-response'),
+                'remoteip': remote_ip or request.remote_addr}
+        try:
+            with external_call('hcaptcha'):
+                r = self.session.post(self.verify_url, data=data, timeout=self.timeout)
+                r.raise_for_status()
+            success = bool(r.json()['success'])
+        except Exception as e:
+            # Anything, including a malformed body, counts as a failure so a
+            # half-open trial always settles the breaker.
+            self.breaker.failure()
+            self.count('errors')
+            current_app.logger.warning('hCaptcha verification failed: %r', e)
+            return self.fail_open
+        self.breaker.success()
+        self.count('passed' if success else 'rejected')
+        return success
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counts, breaker=self.breaker.state)
+
+
+captcha = CaptchaVerifier()
@@ -0,0 +1,134 @@
+import os
+import gzip
+import mimetypes
+from flask import request, send_from_directory, current_app
+from app import bp
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+ENCODINGS = ('br', 'gzip') if brotli else ('gzip',)
+SIDECAR_SUFFIXES = {'br': '.br', 'gzip': '.gz'}
+PRECOMPRESSED = ('.gz', '.br', '.png', '.jpg', '.jpeg', '.gif', '.webp', '.avif',
+                 '.woff', '.woff2', '.ico')
+
+
+def compress(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=current_app.config['COMPRESS_BR_QUALITY'])
+    return gzip.compress(data, compresslevel=current_app.config['COMPRESS_LEVEL'], mtime=0)
+
+
+def accepted_encoding(available=ENCODINGS):
+    for encoding in available:
+        if request.accept_encodings[encoding]:
+            return encoding
+    return None
+
+
+def compressible(response):
+    return (response.status_code == 200
+            and not response.direct_passthrough
+            and not response.is_streamed
+            and 'Content-Encoding' not in response.headers
+            and response.mimetype in current_app.config['COMPRESS_MIMETYPES']
+            and (response.content_length or 0) >= current_app.config['COMPRESS_MIN_SIZE'])
+
+
+@bp.after_app_request
+def compress_response(response):
+    """Compress dynamic responses above COMPRESS_MIN_SIZE."""
+    response.vary.add('Accept-Encoding')
+    if not compressible(response):
+        return response
+    encoding = accepted_encoding()
+    if encoding is None:
+        return response
+    response.set_data(compress(response.get_data(), encoding))
+    response.headers['Content-Encoding'] = encoding
+    etag, weak = response.get_etag()
+    if etag:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+def fresh(path, sidecar):
+    """True if `sidecar` exists and was written after `path` last changed."""
+    try:
+        return os.path.getmtime(sidecar) >= os.path.getmtime(path)
+    except OSError:
+        return False
+
+
+def find_sidecars(static_folder):
+    """Map static filenames to the encodings that have an up-to-date sidecar file."""
+    sidecars = {}
+    for root_path, dirs, files in os.walk(static_folder):
+        names = set(files)
+        for f in files:
+            path = os.path.join(root_path, f)
+            encodings = [e for e in ENCODINGS if f + SIDECAR_SUFFIXES[e] in names
+                         and fresh(path, path + SIDECAR_SUFFIXES[e])]
+            if encodings:
+                filename = os.path.relpath(path, static_folder)
+                sidecars[filename.replace(os.sep, '/')] = encodings
+    return sidecars
+
+
+def send_static(filename, **kwargs):
+    """
+        send_from_directory for the static folder that serves a prebuilt
+        .br/.gz sidecar when the client accepts it. A sidecar older than its
+        source (the file was edited since the build) is ignored.
+    """
+    static_folder = current_app.static_folder
+    encoding = accepted_encoding(current_app.extensions['static_sidecars'].get(filename, ()))
+    if encoding is not None:
+        path = os.path.join(static_folder, filename)
+        if not fresh(path, path + SIDECAR_SUFFIXES[encoding]):
+            encoding = None
+    if encoding is None:
+        return send_from_directory(static_folder, filename, **kwargs)
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    response = send_from_directory(static_folder, filename + SIDECAR_SUFFIXES[encoding],
+                                   mimetype=mimetype, **kwargs)
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+
+def static(filename):
+    return send_static(filename, max_age=current_app.get_send_file_max_age(filename))
+
+
+def init_app(app):
+    """Scan the app's static folder for sidecars and serve them from /static."""
+    app.extensions['static_sidecars'] = find_sidecars(app.static_folder)
+    app.view_functions['static'] = static
+
+
+def write_sidecars(static_folder, exclude=()):
+    """
+        Write .gz (and .br if brotli is installed) sidecars for static files.
+        Returns (files, original bytes, gzipped bytes).
+    """
+    before = after = count = 0
+    for root_path, dirs, files in os.walk(static_folder):
+        rel_dir = os.path.relpath(root_path, static_folder).replace(os.sep, '/')
+        dirs[:] = [d for d in dirs if (d if rel_dir == '.' else rel_dir + '/' + d) not in exclude]
+        for f in files:
+            if f.lower().endswith(PRECOMPRESSED):
+                continue
+            path = os.path.join(root_path, f)
+            with open(path, 'rb') as source:
+                data = source.read()
+            count += 1
+            before += len(data)
+            for encoding in ENCODINGS:
+                compressed = compress(data, encoding)
+                with open(path + SIDECAR_SUFFIXES[encoding], 'wb') as sidecar:
+                    sidecar.write(compressed)
+                if encoding == 'gzip':
+                    after += len(compressed)
+    return count, before, after
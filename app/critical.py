@@ -0,0 +1,129 @@
+import os
+import re
+import json
+import click
+from flask import template_rendered, current_app
+from jinja2 import pass_context
+from markupsafe import Markup
+from app import bp
+from app.assets import assets
+from app.styles import purge, prune_custom_properties, inline_imports, rebase_urls
+
+ATTRIBUTE_TOKENS = re.compile(r'\b(?:class|id)="([^"]*)"')
+START_TAG = re.compile(r'<([a-zA-Z][\w-]*)([^>]*)>')
+ATTRIBUTE_NAMES = re.compile(r'([a-zA-Z_:][\w:.-]*)\s*(?==|\s|/|$)')
+
+
+def load_critical(path):
+    if path and os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    return {}
+
+
+def init_app(app):
+    app.extensions['critical_css'] = load_critical(app.config['CRITICAL_CSS_INDEX'])
+
+
+@bp.app_template_global()
+@pass_context
+def critical_css(context):
+    """
+        Above-the-fold CSS for the page being rendered, or None when it
+        has none or CRITICAL_CSS_ENABLED is off.
+    """
+    if not current_app.config['CRITICAL_CSS_ENABLED'] or current_app.debug:
+        return None
+    css = current_app.extensions['critical_css'].get(context.name)
+    return Markup(css) if css else None
+
+
+def above_fold(html, fold):
+    """The head and the first `fold` characters of the body markup."""
+    body = html.find('<body')
+    return html if body == -1 else html[:body + fold]
+
+
+def fold_tokens(html):
+    tokens = set()
+    for value in ATTRIBUTE_TOKENS.findall(html):
+        tokens.update(value.split())
+    return tokens
+
+
+def fold_markup(html):
+    """The element and attribute names used in `html`, lowercased."""
+    tags, attributes = {'html', 'body'}, set()
+    for tag, rest in START_TAG.findall(html):
+        tags.add(tag.lower())
+        attributes.update(name.lower() for name in ATTRIBUTE_NAMES.findall(rest))
+    return tags, attributes
+
+
+def critical_for(css, html, fold):
+    """The rules of `css` that can apply to the first `fold` characters of the page."""
+    above = above_fold(html, fold)
+    tags, attributes = fold_markup(above)
+    return prune_custom_properties(purge(css, fold_tokens(above), tags, attributes))
+
+
+def full_stylesheet(static_folder, target, aliases_path):
+    """The built stylesheet for `target` if there is one, else the source."""
+    filename = target
+    if os.path.exists(aliases_path):
+        with open(aliases_path) as f:
+            filename = json.load(f).get(target, target)
+    path = os.path.join(static_folder, filename)
+    with open(path, encoding='utf-8') as f:
+        css = inline_imports(f.read(), os.path.dirname(path))
+    return rebase_urls(css, os.path.dirname(path), static_folder,
+                       prefix=current_app.static_url_path + '/')
+
+
+def rendered_pages(paths):
+    """Fetch `paths` and yield (template name, html) for each page rendered."""
+    rendered = []
+
+    def record(sender, template, context, **extra):
+        rendered.append(template.name)
+
+    app = current_app._get_current_object()
+    client = app.test_client()
+    with template_rendered.connected_to(record, app):
+        for path in paths:
+            del rendered[:]
+            response = client.get(path)
+            if response.status_code == 200 and response.mimetype == 'text/html' and rendered:
+                yield rendered[0], response.get_data(as_text=True)
+
+
+@assets.command('critical')
+@click.option('--strict', is_flag=True, help='Fail if a template is over CRITICAL_CSS_BUDGET.')
+def build_critical(strict):
+    """Extract above-the-fold CSS for the home page and the template pages."""
+    config = current_app.config
+    css = full_stylesheet(current_app.static_folder, config['CSS_TARGET'], config['ASSET_ALIASES'])
+    budget = config['CRITICAL_CSS_BUDGET']
+    index = {}
+    over = []
+    paths = ['/'] + sorted(current_app.extensions.get('template_pages', ()))
+    for template, html in rendered_pages(paths):
+        if template in index or template in over:
+            continue
+        page_css = critical_for(css, html, config['CRITICAL_CSS_FOLD']).replace('</', '<\\/')
+        size = len(page_css.encode('utf-8'))
+        click.echo(template + ': ' + str(size) + ' bytes')
+        if budget and size > budget:
+            over.append(template)
+        else:
+            index[template] = page_css
+    if over:
+        message = ', '.join(over) + ' over the ' + str(budget) + \
+            ' byte budget; these pages will link the full stylesheet instead.'
+        if strict:
+            raise click.ClickException(message)
+        click.echo('Warning: ' + message, err=True)
+    with open(config['CRITICAL_CSS_INDEX'], 'w') as f:
+        json.dump(index, f, indent=2, sort_keys=True)
+    click.echo('Wrote critical CSS for ' + str(len(index)) + ' templates to ' +
+               config['CRITICAL_CSS_INDEX'])
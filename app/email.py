@@ -1,144 +1,173 @@
-from threading import Thread
-from app import app
-from mailjet_rest import Client
-from flask import render_template, url_for
-import re
-import datetime
-from dateutil.parser import parse
-
-
-def send_contact_email(user, message):
-    api_key = app.config['MAILJET_KEY']
-    api_secret = app.config['MAILJET_SECRET']
-    mailjet = Client(auth=(api_key, api_secret), version='v3.1')
-
-    data = {
-        'Messages': [
+import json
+import threading
+import requests
+from collections import namedtuple
+from requests.adapters import HTTPAdapter
+from app import db
+from app.models import OutboxMessage
+from app.metrics import external_call
+from flask import render_template, current_app
+
+SendResult = namedtuple('SendResult', ['status', 'error', 'message_id'])
+
+
+class MailjetTransport(object):
+    """
+        Long-lived client for the Mailjet v3.1 Send API. All sends share one
+        keep-alive requests.Session, and send() submits several messages in
+        a single call, returning one SendResult per message in input order.
+    """
+
+    def __init__(self, api_key, api_secret, api_url=None, timeout=10, pool_size=10):
+        self.url = (api_url or 'https://api.mailjet.com/').rstrip('/') + '/v3.1/send'
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.auth = (api_key, api_secret)
+        self.session.headers['Content-Type'] = 'application/json'
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def send(self, messages):
+        try:
+            with external_call('mailjet'):
+                response = self.session.post(self.url, data=json.dumps({'Messages': messages}),
+                                             timeout=self.timeout)
+        except requests.RequestException as e:
+            return [SendResult(None, repr(e), None)] * len(messages)
+        try:
+            results = response.json()['Messages']
+        except (ValueError, KeyError, TypeError):
+            results = None
+        if results is None or len(results) != len(messages):
+            return [SendResult(response.status_code, response.text[:256], None)] * len(messages)
+        return [self.result(r) for r in results]
+
+    def result(self, data):
+        if data.get('Status') == 'success':
+            to = data.get('To') or [{}]
+            return SendResult(200, None, to[0].get('MessageID'))
+        errors = data.get('Errors') or [{}]
+        return SendResult(errors[0].get('StatusCode', 400),
+                          json.dumps(errors)[:256], None)
+
+    def close(self):
+        self.session.close()
+
+
+transport_lock = threading.Lock()
+
+
+def mail_transport():
+    """The current app's MailjetTransport, created on first use."""
+    app = current_app._get_current_object()
+    transport = app.extensions.get('mail_transport')
+    if transport is None:
+        with transport_lock:
+            transport = app.extensions.get('mail_transport')
+            if transport is None:
+                transport = app.extensions['mail_transport'] = MailjetTransport(
+                    app.config['MAILJET_KEY'], app.config['MAILJET_SECRET'],
+                    api_url=app.config['MAILJET_API_URL'],
+                    timeout=app.config['MAILJET_TIMEOUT'],
+                    pool_size=app.config['MAILJET_POOL_SIZE'])
+    return transport
+
+
+def mailjet_message(to, subject, html, reply_to=None):
+    message = {
+        "From": {
+            "Email": current_app.config['MAIL_USERNAME'],
+        },
+        "To": [
             {
-                "From": {
-                    "Email": app.config['MAIL_USERNAME'],
-                },
-                "To": [
-                    {
-                    "Email": app.config['MAIL_USERNAME']
-                    }
-                ],
-                "Subject": "Message from " + user.first_name,
-                "ReplyTo": { "Email": user.email },
-                "HTMLPart": render_template('email/contact-email.html',
-                                         user=user, message=message)
+            "Email": to
             }
-        ]
+        ],
+        "Subject": subject,
+        "HTMLPart": html
     }
+    if reply_to:
+        message["ReplyTo"] = { "Email": reply_to }
+    return message
+
+
+def queue_emails(messages, chained=False):
+    """
+        Persist (kind, message) pairs to the outbox and wake the outbox
+        worker. With `chained`, each message follows the one before it: both
+        go out in the same API call, and if the first fails the follower is
+        held until it is sent, or dropped if it is dead-lettered. Returns
+        the queued OutboxMessage rows, or None if they could not be saved.
+    """
+    from app.outbox import worker
+
+    entries = [OutboxMessage(kind=kind, recipient=m["To"][0]["Email"],
+                             payload=json.dumps(m)) for kind, m in messages]
+    try:
+        db.session.add_all(entries)
+        if chained:
+            db.session.flush()
+            for previous, entry in zip(entries, entries[1:]):
+                entry.after_id = previous.id
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        current_app.logger.exception('Could not queue email')
+        return None
+    worker.notify()
+    return entries
+
+
+def contact_message(user, message):
+    return mailjet_message(current_app.config['MAIL_USERNAME'], "Message from " + user.first_name,
+        render_template('email/contact-email.html', user=user, message=message),
+        reply_to=user.email)
+
+
+def confirmation_message(user, message):
+    return mailjet_message(user.email, "Confirmation email",
+        render_template('email/confirmation-email.html', user=user, message=message))
 
-    result = mailjet.send.create(data=data)
 
-    if result.status_code == 200:
-        send_confirmation_email(user, message)
-        print("Contact email sent from " + user.email)
-    else:
-        print("Contact email from " + user.email + " failed with code " + result.status_code)
-    return result.status_code
+def send_contact_email(user, message):
+    queued = queue_emails([('contact', contact_message(user, message)),
+                           ('confirmation', confirmation_message(user, message))],
+                          chained=True)
+    if queued:
+        print("Contact email queued from " + user.email)
+    return queued
 
 
 def send_confirmation_email(user, message):
-    api_key = app.config['MAILJET_KEY']
-    api_secret = app.config['MAILJET_SECRET']
-    mailjet = Client(auth=(api_key, api_secret), version='v3.1')
-
-    data = {
-        'Messages': [
-            {
-                "From": {
-                    "Email": app.config['MAIL_USERNAME'],
-                },
-                "To": [
-                    {
-                    "Email": user.email
-                    }
-                ],
-                "Subject": "Confirmation email",
-                "HTMLPart": render_template('email/confirmation-email.html',
-                                         user=user, message=message)
-            }
-        ]
-    }
-
-    result = mailjet.send.create(data=data)
-    if result.status_code == 200:
-        print("Confirmation email sent to " + user.email)
-    else:
-        print("Confirmation email to " + user.email + " failed to send with code " + result.status_code, result.reason)
-    return result.status_code
+    queued = queue_emails([('confirmation', confirmation_message(user, message))])
+    if queued:
+        print("Confirmation email queued to " + user.email)
+    return queued
 
 
 def send_verification_email(user):
-    api_key = app.config['MAILJET_KEY']
-    api_secret = app.config['MAILJET_SECRET']
-    mailjet = Client(auth=(api_key, api_secret), version='v3.1')
-
     token = user.get_email_verification_token()
-
-    data = {
-        'Messages': [
-            {
-                "From": {
-                    "Email": app.config['MAIL_USERNAME'],
-                },
-                "To": [
-                    {
-                    "Email": user.email
-                    }
-                ],
-                "Subject": "Please verify your email address",
-                "HTMLPart": render_template('email/verification-email.html',
-                                         user=user, token=token)
-            }
-        ]
-    }
-
-    result = mailjet.send.create(data=data)
-
-    if result.status_code == 200:
-        print("Verification email sent to " + user.email)
-    else:
-        print("Verification email to " + user.email + " failed with code " + result.status_code)
-    return result.status_code
+    queued = queue_emails([('verification', mailjet_message(user.email,
+        "Please verify your email address",
+        render_template('email/verification-email.html', user=user, token=token)))])
+    if queued:
+        print("Verification email queued to " + user.email)
+    return queued
 
 
 def send_password_reset_email(user):
-    api_key = app.config['MAILJET_KEY']
-    api_secret = app.config['MAILJET_SECRET']
-    mailjet = Client(auth=(api_key, api_secret), version='v3.1')
-
     token = user.get_email_verification_token()
     if user.password_hash == None:
         pw_type = 'set'
     else:
         pw_type = 'reset'
 
-    data = {
-        'Messages': [
-            {
-                "From": {
-                    "Email": app.config['MAIL_USERNAME'],
-                },
-                "To": [
-                    {
-                    "Email": user.email
-                    }
-                ],
-                "Subject": pw_type.title() + ' your password',
-                "ReplyTo": { "Email": user.email },
-                "HTMLPart": render_template('email/set-password-email.html', \
-                                         user=user, token=token, pw_type=pw_type)
-            }
-        ]
-    }
-
-    result = mailjet.send.create(data=data)
-    if result.status_code == 200:
-        print(result.json())
-    else:
-        print("Password reset email failed to send with code " + str(result.status_code), result.reason)
-    return result.status_code
+    queued = queue_emails([('password_reset', mailjet_message(user.email,
+        pw_type.title() + ' your password',
+        render_template('email/set-password-email.html', \
+                        user=user, token=token, pw_type=pw_type),
+        reply_to=user.email))])
+    if queued:
+        print("Password " + pw_type + " email queued to " + user.email)
+    return queued
@@ -1,11 +1,25 @@
-from flask import render_template
-from app import app, db
+from time import time
+from flask import render_template, current_app
+from app import bp, db, limiter
+from app.passwords import HasherBusy
 
-@app.errorhandler(404)
+@bp.app_errorhandler(404)
 def not_found_error(error):
     return render_template('errors/404.html'), 404
 
-@app.errorhandler(500)
+@bp.app_errorhandler(429)
+def rate_limit_error(error):
+    limit = limiter.current_limit
+    retry_after = max(1, int(limit.reset_at - time())) if limit else 60
+    return render_template('errors/429.html'), 429, {'Retry-After': str(retry_after)}
+
+@bp.app_errorhandler(HasherBusy)
+def hasher_busy_error(error):
+    db.session.rollback()
+    return render_template('errors/503.html'), 503, \
+        {'Retry-After': str(current_app.config['FORM_RETRY_AFTER'])}
+
+@bp.app_errorhandler(500)
 def internal_error(error):
     db.session.rollback()
     return render_template('errors/500.html'), 500
@@ -72,6 +72,16 @@ class ResetPasswordForm(FlaskForm):
     submit = SubmitField('Reset password')
 
 
+class BroadcastForm(FlaskForm):
+    role = SelectField('Role', choices=[('','All'),('student', 'Students'),('parent', 'Parents'),('admin','Admins')])
+    status = SelectField('Status', choices=[('','Any'),('active', 'Active'),('paused','Paused'),('inactive','Inactive')])
+    subject = StringField('Subject', render_kw={"placeholder": "Subject"}, \
+        validators=[InputRequired()])
+    message = TextAreaField('Message', render_kw={"placeholder": "Message"}, \
+        validators=[InputRequired()])
+    submit = SubmitField('Send')
+
+
 def full_name(User):
     return User.first_name + " " + User.last_name
 
@@ -0,0 +1,169 @@
+import io
+import os
+import json
+import math
+import shutil
+import hashlib
+import click
+from flask import current_app
+from markupsafe import Markup
+from app import bp
+from app.assets import assets, asset_url
+
+MIMETYPES = {'avif': 'image/avif', 'webp': 'image/webp', 'jpeg': 'image/jpeg'}
+EXTENSIONS = {'avif': '.avif', 'webp': '.webp', 'jpeg': '.jpg'}
+QUALITY = {'avif': 50, 'webp': 75, 'jpeg': 78}
+SOURCE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+PREFERENCE = ['avif', 'webp', 'jpeg']
+
+
+def load_variants(path):
+    if path and os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    return {}
+
+
+def init_app(app):
+    app.extensions['image_variants'] = load_variants(app.config['IMAGE_VARIANTS_INDEX'])
+
+
+def formats(entry):
+    return [f for f in PREFERENCE if f in entry['variants']]
+
+
+def srcset(entry, format):
+    return ', '.join(asset_url(filename) + ' ' + str(width) + 'w'
+                     for width, filename in entry['variants'][format])
+
+
+def html_attrs(attrs):
+    return Markup('').join(Markup(' {}="{}"').format(k.replace('_', '-'), v)
+                           for k, v in attrs.items() if v is not None)
+
+
+@bp.app_template_global()
+def picture(filename, alt='', sizes='100vw', loading='lazy', **attrs):
+    """
+        <picture> markup with AVIF/WebP/JPEG srcsets for an image processed
+        by 'flask assets images'; a plain <img> if it has no variants.
+    """
+    entry = current_app.extensions['image_variants'].get(filename)
+    if entry is None:
+        return Markup('<img src="{}" alt="{}"{}>').format(
+            asset_url(filename), alt, html_attrs(dict(attrs, loading=loading)))
+    sources = Markup('').join(
+        Markup('<source type="{}" srcset="{}" sizes="{}">').format(
+            MIMETYPES[format], srcset(entry, format), sizes)
+        for format in formats(entry) if format != 'jpeg')
+    fallback = entry['variants']['jpeg']
+    img = Markup('<img src="{}" srcset="{}" sizes="{}" alt="{}" width="{}" height="{}"{}>').format(
+        asset_url(fallback[-1][1]), srcset(entry, 'jpeg'), sizes, alt,
+        entry['width'], entry['height'], html_attrs(dict(attrs, loading=loading)))
+    return Markup('<picture>') + sources + img + Markup('</picture>')
+
+
+@bp.app_template_global()
+def responsive_background(selector, filename, overlay=None):
+    """
+        <style> block giving `selector` a cover background that picks the
+        smallest variant wide enough for the viewport, in the best format
+        the browser supports. Empty if the image has no variants.
+    """
+    entry = current_app.extensions['image_variants'].get(filename)
+    if entry is None:
+        return Markup('')
+    aspect = entry['width'] / entry['height']
+    layers = [overlay] if overlay else []
+    rules = []
+    previous = 0
+    for i, (width, jpeg) in enumerate(entry['variants']['jpeg']):
+        image_set = ', '.join('url("{}") type("{}")'.format(
+            asset_url(entry['variants'][format][i][1]), MIMETYPES[format])
+            for format in formats(entry))
+        rule = '{0} {{ background-image: {1}; background-image: {2}; }}'.format(
+            selector,
+            ', '.join(layers + ['url("{}")'.format(asset_url(jpeg))]),
+            ', '.join(layers + ['image-set(' + image_set + ')']))
+        if previous:
+            rule = '@media (min-width: {}px), (min-height: {}px) {{ {} }}'.format(
+                previous + 1, math.ceil((previous + 1) / aspect), rule)
+        rules.append(rule)
+        previous = width
+    return Markup('<style>\n') + Markup('\n'.join(rules)) + Markup('\n</style>')
+
+
+def variant_widths(width, widths):
+    largest = min(width, max(widths))
+    return [w for w in sorted(widths) if w < largest] + [largest]
+
+
+def encode(image, format):
+    out = io.BytesIO()
+    if format == 'jpeg':
+        image.convert('RGB').save(out, 'JPEG', quality=QUALITY[format],
+                                  optimize=True, progressive=True)
+    else:
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA')
+        image.save(out, format.upper(), quality=QUALITY[format])
+    return out.getvalue()
+
+
+def build_variants(static_folder, sources, exclude, output_dir, widths, formats):
+    try:
+        from PIL import Image, features
+    except ImportError:
+        raise click.UsageError('Building image variants requires Pillow (pip install Pillow).')
+
+    formats = [f for f in formats if f == 'jpeg' or features.check(f)]
+    if 'jpeg' not in formats:
+        formats.append('jpeg')
+    output = os.path.join(static_folder, output_dir)
+    shutil.rmtree(output, ignore_errors=True)
+    os.makedirs(output)
+
+    index = {}
+    for source_dir in sources:
+        for root_path, dirs, files in os.walk(os.path.join(static_folder, source_dir)):
+            rel_dir = os.path.relpath(root_path, static_folder).replace(os.sep, '/')
+            dirs[:] = [d for d in dirs if rel_dir + '/' + d not in exclude]
+            for f in sorted(files):
+                if not f.lower().endswith(SOURCE_EXTENSIONS):
+                    continue
+                filename = rel_dir + '/' + f
+                with Image.open(os.path.join(root_path, f)) as image:
+                    image.load()
+                    entry = {'width': image.width, 'height': image.height,
+                             'bytes': os.path.getsize(os.path.join(root_path, f)),
+                             'variants': {format: [] for format in formats}}
+                    for width in variant_widths(image.width, widths):
+                        height = round(image.height * width / image.width)
+                        resized = image.resize((width, height), Image.LANCZOS)
+                        for format in formats:
+                            data = encode(resized, format)
+                            name = '{}-{}.{}{}'.format(os.path.splitext(f)[0], width,
+                                hashlib.md5(data).hexdigest()[:10], EXTENSIONS[format])
+                            with open(os.path.join(output, name), 'wb') as out:
+                                out.write(data)
+                            entry['variants'][format].append([width, output_dir + '/' + name])
+                index[filename] = entry
+    return index
+
+
+@assets.command('images')
+def build_images():
+    """Generate resized AVIF/WebP/JPEG variants of static images."""
+    config = current_app.config
+    index = build_variants(current_app.static_folder, config['IMAGE_SOURCES'],
+        config['IMAGE_SOURCES_EXCLUDE'], config['IMAGE_VARIANTS_DIR'],
+        config['IMAGE_WIDTHS'], config['IMAGE_FORMATS'])
+    with open(config['IMAGE_VARIANTS_INDEX'], 'w') as f:
+        json.dump(index, f, indent=2, sort_keys=True)
+    for filename, entry in index.items():
+        smallest = {format: os.path.getsize(os.path.join(current_app.static_folder, v[0][1]))
+                    for format, v in entry['variants'].items()}
+        click.echo(filename + ': ' + str(entry['bytes']) + ' bytes, smallest ' +
+                   ', '.join(f + ' ' + str(b) for f, b in smallest.items()))
+    click.echo('Wrote ' + str(len(index)) + ' images to ' + config['IMAGE_VARIANTS_INDEX'] +
+               '; run "flask assets build" to refresh the asset manifest.')
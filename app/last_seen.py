@@ -0,0 +1,100 @@
+import atexit
+import threading
+from time import monotonic
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import update, bindparam
+from app import db
+from app.models import User
+
+
+EPOCH = datetime(1970, 1, 1)
+# Core executemany rather than the ORM bulk update, so ids of users deleted
+# since they were touched just match no row instead of raising StaleDataError.
+UPDATE_LAST_VIEWED = update(User.__table__).where(User.__table__.c.id == bindparam('uid')) \
+    .values(last_viewed=bindparam('ts'))
+
+
+class LastSeenBuffer(object):
+    """
+        Write-behind buffer for User.last_viewed. Requests only record a
+        timestamp in memory (coalesced per user and truncated to
+        `resolution` seconds); pending timestamps are written in a single
+        batched UPDATE every `interval` seconds and at shutdown (using the
+        last app passed to init_app()).
+    """
+
+    def __init__(self, resolution=60, interval=60):
+        self.app = None
+        self.resolution = resolution
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.written = {}
+        self.last_flush = monotonic()
+        self.flushes = 0
+        self.flushed_rows = 0
+        self.touches = 0
+
+    def init_app(self, app):
+        self.app = app
+        self.resolution = app.config['LAST_SEEN_RESOLUTION']
+        self.interval = app.config['LAST_SEEN_FLUSH_INTERVAL']
+
+    def bucket(self, when):
+        seconds = int((when - EPOCH).total_seconds())
+        return EPOCH + timedelta(seconds=seconds // self.resolution * self.resolution)
+
+    def touch(self, user_id, when=None):
+        bucket = self.bucket(when or datetime.utcnow())
+        with self.lock:
+            self.touches += 1
+            if self.written.get(user_id) != bucket:
+                self.pending[user_id] = bucket
+
+    def due(self):
+        return monotonic() - self.last_flush >= self.interval
+
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            self.last_flush = monotonic()
+        if not pending:
+            return 0
+        try:
+            db.session.execute(UPDATE_LAST_VIEWED,
+                [{'uid': id, 'ts': ts} for id, ts in pending.items()],
+                execution_options={'user_ids': list(pending)})
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            with self.lock:
+                for id, ts in pending.items():
+                    self.pending.setdefault(id, ts)
+            current_app.logger.exception('Could not flush last_viewed for %d users', len(pending))
+            return 0
+        with self.lock:
+            newest = max(pending.values())
+            self.written = {id: ts for id, ts in self.written.items() if ts >= newest}
+            self.written.update(pending)
+            self.flushes += 1
+            self.flushed_rows += len(pending)
+        current_app.logger.debug('Flushed last_viewed for %d users', len(pending))
+        return len(pending)
+
+    def stats(self):
+        with self.lock:
+            return {'touches': self.touches, 'pending': len(self.pending),
+                    'flushes': self.flushes, 'flushed_rows': self.flushed_rows}
+
+
+last_seen = LastSeenBuffer()
+
+
+def flush_at_exit():
+    if last_seen.app is not None:
+        with last_seen.app.app_context():
+            last_seen.flush()
+
+
+atexit.register(flush_at_exit)
@@ -0,0 +1,74 @@
+import os
+import random
+import sqlite3
+import threading
+from time import time
+from urllib.parse import urlparse
+from limits.storage import Storage
+
+SCHEMA = 'CREATE TABLE IF NOT EXISTS limits (key TEXT PRIMARY KEY, count INTEGER, expires REAL)'
+INCR = """
+    INSERT INTO limits (key, count, expires) VALUES (:key, :amount, :expires)
+    ON CONFLICT (key) DO UPDATE SET
+        count = CASE WHEN expires <= :now THEN :amount ELSE count + :amount END,
+        expires = CASE WHEN expires <= :now OR :elastic THEN :expires ELSE expires END
+    RETURNING count
+"""
+
+
+class SQLiteStorage(Storage):
+    """
+        Rate limit counters in a local SQLite file, shared by every worker
+        on the host. Use RATELIMIT_STORAGE_URI=sqlite:////path/to/limits.db.
+        Each hit is a single upsert; expired rows are purged now and then.
+    """
+
+    STORAGE_SCHEME = ['sqlite']
+    PURGE_CHANCE = 0.001
+
+    def __init__(self, uri, **options):
+        super().__init__(uri, **options)
+        self.path = urlparse(uri).path
+        self.local = threading.local()
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.connection().execute(SCHEMA)
+
+    def connection(self):
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self.local.connection = connection
+        return connection
+
+    def incr(self, key, expiry, elastic_expiry=False, amount=1):
+        now = time()
+        if random.random() < self.PURGE_CHANCE:
+            self.connection().execute('DELETE FROM limits WHERE expires <= ?', (now,))
+        return self.connection().execute(INCR, {'key': key, 'amount': amount, 'now': now,
+            'expires': now + expiry, 'elastic': bool(elastic_expiry)}).fetchone()[0]
+
+    def get(self, key):
+        row = self.connection().execute('SELECT count FROM limits WHERE key = ? AND expires > ?',
+                                        (key, time())).fetchone()
+        return row[0] if row else 0
+
+    def get_expiry(self, key):
+        row = self.connection().execute('SELECT expires FROM limits WHERE key = ? AND expires > ?',
+                                        (key, time())).fetchone()
+        return int(row[0]) if row else int(time())
+
+    def check(self):
+        try:
+            self.connection().execute('SELECT 1')
+            return True
+        except sqlite3.Error:
+            return False
+
+    def reset(self):
+        return self.connection().execute('DELETE FROM limits').rowcount
+
+    def clear(self, key):
+        self.connection().execute('DELETE FROM limits WHERE key = ?', (key,))
@@ -0,0 +1,201 @@
+import hmac
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from time import perf_counter
+from flask import request, g, abort, current_app, has_request_context, request_started, \
+    request_finished, before_render_template, template_rendered
+from app import db, query_timing
+
+LATENCY_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+RENDER_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+
+registry = []
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric(object):
+    """
+        A metric family whose series are keyed by a tuple of label values,
+        passed positionally in the order of `labels`. Updates take a lock
+        per family; nothing runs between scrapes.
+    """
+
+    kind = 'untyped'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values = {}
+        self.lock = threading.Lock()
+        registry.append(self)
+
+    def label_text(self, key, extra=''):
+        pairs = ['{}="{}"'.format(l, escape(v)) for l, v in zip(self.labels, key)]
+        if extra:
+            pairs.append(extra)
+        return '{' + ','.join(pairs) + '}' if pairs else ''
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.help),
+                 '# TYPE {} {}'.format(self.name, self.kind)]
+        with self.lock:
+            series = sorted((key, list(value) if isinstance(value, list) else value)
+                            for key, value in self.values.items())
+        for key, value in series:
+            lines.extend(self.samples(key, value))
+        return lines
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, *key, amount=1):
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self, key, value):
+        yield self.name + self.label_text(key) + ' ' + number(value)
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        Metric.__init__(self, name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *key):
+        i = bisect_left(self.buckets, value)
+        with self.lock:
+            entry = self.values.get(key)
+            if entry is None:
+                entry = self.values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            entry[i] += 1
+            entry[-1] += value
+
+    def samples(self, key, value):
+        counts, total = value[:-1], value[-1]
+        cumulative = 0
+        for bound, count in zip(self.buckets + ('+Inf',), counts):
+            cumulative += count
+            le = 'le="{}"'.format(bound if bound == '+Inf' else '%g' % bound)
+            yield self.name + '_bucket' + self.label_text(key, le) + ' ' + str(cumulative)
+        yield self.name + '_sum' + self.label_text(key) + ' ' + number(float(total))
+        yield self.name + '_count' + self.label_text(key) + ' ' + str(cumulative)
+
+
+requests_total = Counter('http_requests_total', 'Requests handled, by endpoint and status.',
+                         ('endpoint', 'method', 'status'))
+request_seconds = Histogram('http_request_duration_seconds',
+                            'Time from dispatch to the finished response.', ('endpoint', 'method'))
+request_queries = Histogram('http_request_db_queries', 'SQL statements run per request.',
+                            ('endpoint',), QUERY_COUNT_BUCKETS)
+request_query_seconds = Histogram('http_request_db_seconds', 'SQL time spent per request.',
+                                  ('endpoint',))
+queries_total = Counter('db_queries_total', 'SQL statements run, in or out of requests.')
+query_seconds_total = Counter('db_query_seconds_total', 'SQL time, in or out of requests.')
+render_seconds = Histogram('template_render_seconds', 'Jinja template render time.',
+                           ('template',), RENDER_BUCKETS)
+external_seconds = Histogram('external_call_duration_seconds',
+                             'Outbound API call time, by service and outcome.',
+                             ('service', 'outcome'))
+
+
+@contextmanager
+def external_call(service):
+    """Time the enclosed outbound call; it counts as an error if it raises."""
+    start = perf_counter()
+    outcome = 'error'
+    try:
+        yield
+        outcome = 'ok'
+    finally:
+        external_seconds.observe(perf_counter() - start, service, outcome)
+
+
+def endpoint_label():
+    return request.url_rule.endpoint if request.url_rule else 'unmatched'
+
+
+def start_request(sender, **extra):
+    g.request_metrics = [perf_counter(), 0, 0.0]
+
+
+def finish_request(sender, response, **extra):
+    stats = g.pop('request_metrics', None)
+    if stats is None:
+        return
+    endpoint = endpoint_label()
+    requests_total.inc(endpoint, request.method, response.status_code)
+    request_seconds.observe(perf_counter() - stats[0], endpoint, request.method)
+    request_queries.observe(stats[1], endpoint)
+    request_query_seconds.observe(stats[2], endpoint)
+
+
+def start_render(sender, template, context, **extra):
+    g.setdefault('render_starts', []).append(perf_counter())
+
+
+def finish_render(sender, template, context, **extra):
+    starts = g.get('render_starts')
+    if starts:
+        render_seconds.observe(perf_counter() - starts.pop(), template.name or 'string')
+
+
+def record_query(conn, statement, parameters, executemany, elapsed):
+    queries_total.inc()
+    query_seconds_total.inc(amount=elapsed)
+    if has_request_context():
+        stats = g.get('request_metrics')
+        if stats is not None:
+            stats[1] += 1
+            stats[2] += elapsed
+
+
+def render():
+    lines = []
+    for metric in registry:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+def scrape_allowed():
+    """
+        Requires METRICS_TOKEN as a bearer token. Without one, only a debug
+        server answers, and only on loopback: behind a reverse proxy every
+        request comes from loopback, so the address proves nothing.
+    """
+    token = current_app.config['METRICS_TOKEN']
+    if token:
+        return hmac.compare_digest(request.headers.get('Authorization', ''), 'Bearer ' + token)
+    return current_app.debug and request.remote_addr in ('127.0.0.1', '::1')
+
+
+def metrics():
+    if not scrape_allowed():
+        abort(404)
+    return render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8',
+                           'Cache-Control': 'no-store'}
+
+
+def init_app(app):
+    """With METRICS_ENABLED, connect the request, template and SQL hooks and add /metrics."""
+    if not app.config['METRICS_ENABLED']:
+        return
+    request_started.connect(start_request, app)
+    request_finished.connect(finish_request, app)
+    before_render_template.connect(start_render, app)
+    template_rendered.connect(finish_render, app)
+    with app.app_context():
+        query_timing.subscribe(db.engine, record_query)
+    app.add_url_rule('/metrics', 'metrics', metrics)
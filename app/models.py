@@ -1,8 +1,12 @@
 from datetime import datetime
 from time import time
+import json
+import base64
 import jwt
-from app import db, login, app
-from werkzeug.security import generate_password_hash, check_password_hash
+from sqlalchemy import func, tuple_
+from flask import current_app
+from app import db, login
+from app.passwords import hasher, HasherBusy
 from flask_login import UserMixin
 
 
@@ -12,11 +16,11 @@ class User(UserMixin, db.Model):
     last_name = db.Column(db.String(32))
     email = db.Column(db.String(64), unique=True, index=True)
     phone = db.Column(db.String(32))
-    password_hash = db.Column(db.String(128))
+    password_hash = db.Column(db.String(256))
     location = db.Column(db.String(128))
-    status = db.Column(db.String(24))
-    role = db.Column(db.String(24))
-    parent_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    status = db.Column(db.String(24), index=True)
+    role = db.Column(db.String(24), index=True)
+    parent_id = db.Column(db.Integer, db.ForeignKey('user.id'), index=True)
     children = db.relationship('User',
         primaryjoin=(id==parent_id),
         backref=db.backref('parent', remote_side=[id]),
@@ -31,26 +35,134 @@ class User(UserMixin, db.Model):
         return '<User {}>'.format(self.email)
 
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = hasher.hash(password)
 
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        if not hasher.check(self.password_hash, password):
+            return False
+        if hasher.needs_rehash(self.password_hash):
+            try:
+                self.password_hash = hasher.hash(password)
+            except HasherBusy:
+                pass  # rehash on a later login
+        return True
     
     def get_email_verification_token(self, expires_in=3600):
         return jwt.encode(
             {'reset_password': self.id, 'exp': time() + expires_in},
-            app.config['SECRET_KEY'], algorithm='HS256')
+            current_app.config['SECRET_KEY'], algorithm='HS256')
 
     @staticmethod
     def verify_email_token(token):
         try:
-            id = jwt.decode(token, app.config['SECRET_KEY'],
+            id = jwt.decode(token, current_app.config['SECRET_KEY'],
                             algorithms=['HS256'])['reset_password']
         except:
             return
         return User.query.get(id)
 
 
+DIRECTORY_ROLES = ['parent', 'student', 'admin']
+DIRECTORY_SECTIONS = [r.title() + 's' for r in DIRECTORY_ROLES] + ['Other']
+
+
+def directory_name():
+    return func.coalesce(User.first_name, '')
+
+
+def directory_filter(section):
+    """
+        Rows in directory section `section`: active users with the n-th
+        role of DIRECTORY_ROLES, then everyone else.
+    """
+    if section < len(DIRECTORY_ROLES):
+        return (User.status == 'active') & (User.role == DIRECTORY_ROLES[section])
+    return ~((func.coalesce(User.status, '') == 'active') &
+             func.coalesce(User.role, '').in_(DIRECTORY_ROLES))
+
+
+# Each role section is one range of ix_user_directory, already in page order;
+# the 'Other' section walks ix_user_directory_name and filters.
+db.Index('ix_user_directory', User.status, User.role, directory_name(), User.id)
+db.Index('ix_user_directory_name', directory_name(), User.id)
+# Case-insensitive email lookups, e.g. matching rows in 'flask users import'.
+db.Index('ix_user_email_lower', func.lower(User.email))
+
+
+def directory_page(cursor=None, per_page=100):
+    """
+        One page of the admin directory ordered by (section, first name, id),
+        using keyset pagination one section at a time. Returns
+        [(section, user), ...] and the cursor for the next page, or None on
+        the last page.
+    """
+    name = directory_name()
+    after = decode_cursor(cursor)
+    rows = []
+    for section in range(after[0] if after else 0, len(DIRECTORY_SECTIONS)):
+        q = User.query.filter(directory_filter(section)).order_by(name, User.id)
+        if after and section == after[0]:
+            # name >= ... gives the planner a range to seek; the tuple breaks ties
+            q = q.filter(name >= after[1], tuple_(name, User.id) > tuple_(after[1], after[2]))
+        rows.extend((section, u) for u in q.limit(per_page + 1 - len(rows)))
+        if len(rows) > per_page:
+            break
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        last_section, last = rows[-1]
+        next_cursor = encode_cursor([last_section, last.first_name or '', last.id])
+    return rows, next_cursor
+
+
+def directory_counts():
+    counts = dict(db.session.query(User.role, func.count(User.id))
+                  .filter(User.status == 'active', User.role.in_(DIRECTORY_ROLES))
+                  .group_by(User.role).all())
+    counts = {i: counts.get(role, 0) for i, role in enumerate(DIRECTORY_ROLES)}
+    counts[len(DIRECTORY_ROLES)] = db.session.query(func.count(User.id)).scalar() - \
+        sum(counts.values())
+    return counts
+
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_cursor(cursor):
+    if not cursor:
+        return None
+    try:
+        section, name, id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return [int(section), str(name), int(id)]
+    except (ValueError, TypeError):
+        return None
+
+
+class OutboxMessage(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(32))
+    recipient = db.Column(db.String(64))
+    payload = db.Column(db.Text)
+    status = db.Column(db.String(12), default='pending')
+    attempts = db.Column(db.Integer, default=0)
+    next_attempt = db.Column(db.DateTime, default=datetime.utcnow)
+    last_error = db.Column(db.String(256))
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime)
+    # Sent in the same API call as the message with this id, and held until
+    # it is sent if that call fails for it, e.g. a contact confirmation
+    # follows the contact email itself.
+    after_id = db.Column(db.Integer, index=True)
+
+    __table_args__ = (db.Index('ix_outbox_message_due', 'status', 'next_attempt'),)
+
+    def __repr__(self):
+        return '<OutboxMessage {} {} {}>'.format(self.id, self.kind, self.status)
+
+
 @login.user_loader
 def load_user(id):
-    return User.query.get(id)
+    from app.user_cache import user_cache
+
+    return user_cache.load(id)
@@ -0,0 +1,254 @@
+import json
+import threading
+import click
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import select, update, func, case, or_
+from sqlalchemy.orm import aliased
+from app import bp, db
+from app.models import OutboxMessage
+from app.email import mail_transport
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class OutboxWorker(object):
+    """
+        Sends queued OutboxMessage rows in the background. A dispatcher
+        thread claims due rows (bumping next_attempt by a lease so other
+        processes skip them), hands the Mailjet calls to a thread pool and
+        records the results. Each claim is split into API calls of at least
+        min_chunk messages, so small claims go out in a single call. Failed
+        sends are retried with exponential backoff and dead-lettered after
+        max_attempts. A row that follows another (after_id) goes out in the
+        same call as it; if that one fails, the follower is held until it is
+        sent and dead-lettered with it.
+    """
+
+    def __init__(self, app=None, workers=4, batch_size=20, min_chunk=10, poll_interval=5,
+                 max_attempts=6, backoff=30, max_backoff=3600, lease=300):
+        self.app = app
+        self.workers = workers
+        self.batch_size = batch_size
+        self.min_chunk = min_chunk
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.lease = lease
+        self.wake = threading.Event()
+        self.stopping = threading.Event()
+        self.lock = threading.Lock()
+        self.thread = None
+        self.pool = None
+        self.sent = 0
+        self.retried = 0
+        self.dead = 0
+
+    def init_app(self, app):
+        """Send for `app`; the dispatcher thread uses the last app given."""
+        self.app = app
+        self.workers = app.config['OUTBOX_WORKERS']
+        self.batch_size = app.config['OUTBOX_BATCH_SIZE']
+        self.min_chunk = app.config['OUTBOX_MIN_CHUNK']
+        self.poll_interval = app.config['OUTBOX_POLL_INTERVAL']
+        self.max_attempts = app.config['OUTBOX_MAX_ATTEMPTS']
+        self.backoff = app.config['OUTBOX_BACKOFF']
+
+    def start(self):
+        with self.lock:
+            if self.thread is not None and self.thread.is_alive():
+                return
+            self.stopping.clear()
+            self.pool = ThreadPoolExecutor(self.workers, thread_name_prefix='outbox')
+            self.thread = threading.Thread(target=self.run, name='outbox-dispatcher',
+                                           daemon=True)
+            self.thread.start()
+
+    def stop(self, timeout=10):
+        self.stopping.set()
+        self.wake.set()
+        if self.thread is not None:
+            self.thread.join(timeout)
+        if self.pool is not None:
+            self.pool.shutdown(wait=True)
+
+    def notify(self):
+        if self.app.config['OUTBOX_INLINE_WORKER']:
+            self.start()
+        self.wake.set()
+
+    def run(self):
+        while not self.stopping.is_set():
+            self.wake.clear()
+            processed = 0
+            try:
+                with self.app.app_context():
+                    processed = self.process_due()
+            except Exception:
+                self.app.logger.exception('Outbox dispatch failed')
+            if processed < self.batch_size:
+                self.wake.wait(self.poll_interval)
+
+    def claim(self):
+        now = datetime.utcnow()
+        parent = aliased(OutboxMessage)
+        waiting = OutboxMessage.after_id.in_(select(parent.id).where(parent.status != 'sent'))
+        due = db.session.execute(
+            select(OutboxMessage.id, OutboxMessage.next_attempt)
+            .where(OutboxMessage.status == 'pending', OutboxMessage.next_attempt <= now,
+                   or_(OutboxMessage.after_id.is_(None), ~waiting))
+            .order_by(OutboxMessage.next_attempt)
+            .limit(self.batch_size)).all()
+        claimed = [id for id, next_attempt in due if self.claim_row(id, next_attempt, now)]
+        if claimed:
+            # Followers go out in the same API call as the message they follow.
+            followers = db.session.execute(
+                select(OutboxMessage.id, OutboxMessage.next_attempt)
+                .where(OutboxMessage.status == 'pending',
+                       OutboxMessage.after_id.in_(claimed))).all()
+            claimed += [id for id, next_attempt in followers
+                        if self.claim_row(id, next_attempt, now)]
+        db.session.commit()
+        if not claimed:
+            return []
+        return OutboxMessage.query.filter(OutboxMessage.id.in_(claimed)) \
+            .order_by(OutboxMessage.id).all()
+
+    def claim_row(self, id, next_attempt, now):
+        result = db.session.execute(
+            update(OutboxMessage)
+            .where(OutboxMessage.id == id, OutboxMessage.status == 'pending',
+                   OutboxMessage.next_attempt == next_attempt)
+            .values(next_attempt=now + timedelta(seconds=self.lease),
+                    attempts=OutboxMessage.attempts + 1)
+            .execution_options(synchronize_session=False))
+        return result.rowcount > 0
+
+    def chunks(self, entries):
+        """
+            Split `entries` into API calls for the pool: spread over the
+            workers, but no smaller than min_chunk or larger than
+            MAILJET_BATCH_SIZE, and never separating a follower from the
+            message it follows.
+        """
+        size = min(self.app.config['MAILJET_BATCH_SIZE'],
+                   max(self.min_chunk, -(-len(entries) // self.workers)))
+        groups = {}
+        for entry in entries:
+            key = entry.after_id if entry.after_id in groups else entry.id
+            groups.setdefault(key, []).append(entry)
+        chunks = [[]]
+        for group in groups.values():
+            if chunks[-1] and len(chunks[-1]) + len(group) > size:
+                chunks.append([])
+            chunks[-1].extend(group)
+        return chunks
+
+    def process_due(self):
+        entries = self.claim()
+        if not entries:
+            return 0
+        chunks = self.chunks(entries)
+        results = self.pool.map(mail_transport().send,
+            [[json.loads(e.payload) for e in chunk] for chunk in chunks])
+        for chunk, chunk_results in zip(chunks, results):
+            sent_with = {entry.id: entry for entry in chunk}
+            for entry, result in zip(chunk, chunk_results):
+                self.record(entry, result.status, result.error,
+                            after=sent_with.get(entry.after_id))
+        db.session.commit()
+        return len(entries)
+
+    def record(self, entry, status, error, after=None):
+        now = datetime.utcnow()
+        if status == 200:
+            entry.status = 'sent'
+            entry.sent_at = now
+            entry.last_error = None
+            self.sent += 1
+            self.app.logger.info('%s email sent to %s', entry.kind, entry.recipient)
+            self.release(entry, status='pending', next_attempt=now)
+            return
+        entry.last_error = error
+        if after is not None and after.status != 'sent':
+            # The message this one follows failed in the same call: wait for
+            # it to be sent rather than retrying on its own.
+            if after.status == 'dead':
+                self.dead_letter(entry, 'Not sent: ' + after.kind + ' email was dead-lettered')
+            else:
+                entry.status = 'held'
+            return
+        retryable = status is None or status in RETRY_STATUSES
+        if retryable and entry.attempts < self.max_attempts:
+            delay = min(self.backoff * 2 ** (entry.attempts - 1), self.max_backoff)
+            entry.next_attempt = now + timedelta(seconds=delay)
+            self.retried += 1
+        else:
+            self.app.logger.error('%s email to %s dead-lettered after %d attempts: %s',
+                entry.kind, entry.recipient, entry.attempts, error)
+            self.dead_letter(entry, error)
+
+    def dead_letter(self, entry, error):
+        entry.status = 'dead'
+        entry.last_error = error
+        self.dead += 1
+        self.release(entry, status='dead',
+                     last_error='Not sent: ' + entry.kind + ' email was dead-lettered')
+
+    def release(self, entry, **values):
+        result = db.session.execute(
+            update(OutboxMessage)
+            .where(OutboxMessage.after_id == entry.id, OutboxMessage.status == 'held')
+            .values(**values)
+            .execution_options(synchronize_session=False))
+        if result.rowcount and values['status'] == 'pending':
+            self.wake.set()
+
+    def stats(self):
+        return {'sent': self.sent, 'retried': self.retried, 'dead': self.dead}
+
+
+worker = OutboxWorker()
+
+
+@bp.cli.group()
+def outbox():
+    """Email outbox commands."""
+    pass
+
+
+@outbox.command('worker')
+def run_worker():
+    """Send queued emails until interrupted."""
+    worker.start()
+    click.echo('Outbox worker running, press Ctrl+C to stop.')
+    try:
+        while worker.thread.is_alive():
+            worker.thread.join(1)
+    except KeyboardInterrupt:
+        worker.stop()
+    click.echo(str(worker.stats()))
+
+
+@outbox.command('status')
+def outbox_status():
+    """Show message counts by status."""
+    counts = db.session.execute(
+        select(OutboxMessage.status, func.count()).group_by(OutboxMessage.status)).all()
+    for status, count in counts:
+        click.echo(status + ': ' + str(count))
+
+
+@outbox.command('requeue')
+def requeue_dead():
+    """Move dead-lettered messages back to the queue."""
+    parent = aliased(OutboxMessage)
+    waiting = OutboxMessage.after_id.in_(select(parent.id).where(parent.status != 'sent'))
+    result = db.session.execute(
+        update(OutboxMessage).where(OutboxMessage.status == 'dead')
+        .values(status=case((waiting, 'held'), else_='pending'), attempts=0,
+                next_attempt=datetime.utcnow())
+        .execution_options(synchronize_session=False))
+    db.session.commit()
+    click.echo('Requeued ' + str(result.rowcount) + ' messages')
@@ -0,0 +1,190 @@
+import os
+import json
+import hashlib
+import tempfile
+import threading
+import click
+from time import time, monotonic
+from functools import wraps
+from cachetools import LRUCache
+from flask import request, session, make_response, current_app
+from flask_login import current_user
+from app import bp
+
+
+class MemoryPageBackend(object):
+    def __init__(self, maxsize=512, ttl=300):
+        self.cache = LRUCache(maxsize=maxsize)
+        self.ttl = ttl
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.cache.get(key)
+        if entry is None or time() - entry[0] > self.ttl:
+            return None
+        return entry[1]
+
+    def set(self, key, page):
+        with self.lock:
+            self.cache[key] = (time(), page)
+
+    def clear(self):
+        with self.lock:
+            self.cache.clear()
+
+
+class DiskPageBackend(object):
+    """
+        Pages stored as files under `directory` so every worker process
+        shares them. Each file is a JSON header line followed by the body,
+        written to a temp file and renamed into place.
+    """
+
+    def __init__(self, directory, ttl=300):
+        self.directory = directory
+        self.ttl = ttl
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.directory, key)
+
+    def get(self, key):
+        try:
+            with open(self.path(key), 'rb') as f:
+                if time() - os.fstat(f.fileno()).st_mtime > self.ttl:
+                    return None
+                meta = json.loads(f.readline())
+                return Page(f.read(), meta['mimetype'], meta['etag'])
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def set(self, key, page):
+        header = json.dumps({'mimetype': page.mimetype, 'etag': page.etag}).encode()
+        fd, tmp = tempfile.mkstemp(dir=self.directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(header + b'\n' + page.body)
+            os.replace(tmp, self.path(key))
+        except OSError:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def clear(self):
+        for name in os.listdir(self.directory):
+            os.remove(self.path(name))
+
+
+class Page(object):
+    def __init__(self, body, mimetype, etag=None):
+        self.body = body
+        self.mimetype = mimetype
+        self.etag = etag or hashlib.md5(body).hexdigest()
+
+
+class PageCache(object):
+    """
+        Full-page cache for the auto-registered template pages. Pages are
+        keyed on path, the signed-in user and a fingerprint of the templates
+        and static assets, so a deploy or template edit starts a fresh
+        cache. Requests with pending flashed messages bypass the cache.
+    """
+
+    def __init__(self, backend, template_folder, manifest, check_interval=None):
+        self.backend = backend
+        self.template_folder = template_folder
+        self.manifest = manifest
+        self.check_interval = check_interval
+        self.checked = monotonic()
+        self.version = self.fingerprint()
+        self.hits = 0
+        self.misses = 0
+
+    def fingerprint(self):
+        digest = hashlib.md5()
+        for root_path, dirs, files in os.walk(self.template_folder):
+            dirs.sort()
+            for f in sorted(files):
+                path = os.path.join(root_path, f)
+                digest.update((path + str(os.path.getmtime(path))).encode())
+        digest.update(json.dumps(self.manifest.assets, sort_keys=True).encode())
+        return digest.hexdigest()[:12]
+
+    def current_version(self):
+        if self.check_interval is not None and monotonic() - self.checked > self.check_interval:
+            self.checked = monotonic()
+            self.version = self.fingerprint()
+        return self.version
+
+    def key(self):
+        user = current_user.get_id() if current_user.is_authenticated else 'anon'
+        raw = '|'.join([self.current_version(), request.path, str(user)])
+        return hashlib.sha1(raw.encode()).hexdigest()
+
+    def respond(self, f, *args, **kwargs):
+        """The response of view `f`, served from the cache when possible."""
+        if request.method != 'GET' or session.get('_flashes'):
+            return f(*args, **kwargs)
+        key = self.key()
+        page = self.backend.get(key)
+        if page is None:
+            self.misses += 1
+            response = make_response(f(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+            page = Page(response.get_data(), response.mimetype)
+            self.backend.set(key, page)
+        else:
+            self.hits += 1
+        response = make_response(page.body)
+        response.mimetype = page.mimetype
+        response.set_etag(page.etag)
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        response.vary.add('Cookie')
+        return response.make_conditional(request)
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
+
+
+def make_page_cache(app):
+    ttl = app.config['PAGE_CACHE_TTL']
+    if app.config['PAGE_CACHE_DIR']:
+        backend = DiskPageBackend(app.config['PAGE_CACHE_DIR'], ttl)
+    else:
+        backend = MemoryPageBackend(app.config['PAGE_CACHE_SIZE'], ttl)
+    check_interval = 2 if app.debug or app.config['TEMPLATES_AUTO_RELOAD'] else None
+    return PageCache(backend, os.path.join(app.root_path, app.template_folder),
+                     app.extensions['asset_manifest'], check_interval)
+
+
+def init_app(app):
+    """Build the app's page cache; after the asset manifest, which keys it."""
+    app.extensions['page_cache'] = make_page_cache(app) \
+        if app.config['PAGE_CACHE_ENABLED'] else None
+
+
+def cached_page(f):
+    """Cache the view with the app's page cache when PAGE_CACHE_ENABLED is set."""
+    @wraps(f)
+    def wrap(*args, **kwargs):
+        page_cache = current_app.extensions['page_cache']
+        if page_cache is None:
+            return f(*args, **kwargs)
+        return page_cache.respond(f, *args, **kwargs)
+    return wrap
+
+
+@bp.cli.command('clear-page-cache')
+def clear_page_cache():
+    """Remove all cached pages."""
+    page_cache = current_app.extensions['page_cache']
+    if page_cache is None:
+        click.echo('The page cache is disabled.')
+        return
+    page_cache.clear()
+    click.echo('Page cache cleared.')
@@ -0,0 +1,104 @@
+import threading
+from time import monotonic
+from itertools import chain
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+from app import bp, db
+from app.models import User
+
+PARENT_FIELDS = ('role', 'first_name', 'last_name')
+
+
+class ParentChoices(object):
+    """
+        Cached (id, name) list of parent users for the parent selects on the
+        user forms. Session events invalidate it whenever a parent is added,
+        renamed, deleted or changes role; the TTL bounds staleness across
+        worker processes, and select_choices() reloads early when a form
+        submits a parent this process hasn't seen yet.
+    """
+
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.choices = None
+        self.loaded = 0
+        self.generation = 0
+
+    def init_app(self, app):
+        self.ttl = app.config['PARENT_CHOICES_TTL']
+        self.invalidate()
+
+    def get(self):
+        choices = self.choices
+        if choices is not None and monotonic() - self.loaded < self.ttl:
+            return choices
+        with self.lock:
+            generation = self.generation
+        rows = db.session.query(User.id, User.first_name, User.last_name) \
+            .filter(User.role == 'parent').order_by(User.first_name, User.last_name).all()
+        choices = [(id, ' '.join(n for n in (first, last) if n)) for id, first, last in rows]
+        with self.lock:
+            if generation == self.generation:
+                self.choices = choices
+                self.loaded = monotonic()
+        return choices
+
+    def select_choices(self, selected=None):
+        choices = self.get()
+        if selected and selected not in (id for id, name in choices) and \
+                User.query.filter_by(id=selected, role='parent').count():
+            self.invalidate()
+            choices = self.get()
+        return [(0, '')] + choices
+
+    def name(self, id):
+        for choice_id, name in self.get():
+            if choice_id == id:
+                return name
+        return ''
+
+    def search(self, q, limit=20):
+        q = q.strip().lower()
+        return [c for c in self.get() if q in c[1].lower()][:limit]
+
+    def invalidate(self):
+        with self.lock:
+            self.generation += 1
+            self.choices = None
+
+
+parent_choices = ParentChoices()
+
+
+def affects_parents(obj, changed):
+    if not isinstance(obj, User):
+        return False
+    if not changed:
+        return obj.role == 'parent'
+    state = inspect(obj)
+    if not any(state.attrs[f].history.has_changes() for f in PARENT_FIELDS):
+        return False
+    return obj.role == 'parent' or 'parent' in state.attrs.role.history.deleted
+
+
+@event.listens_for(Session, 'after_flush')
+def parent_writes(session, flush_context):
+    objects = chain(((o, False) for o in session.new),
+                    ((o, True) for o in session.dirty),
+                    ((o, False) for o in session.deleted))
+    if any(affects_parents(o, changed) for o, changed in objects):
+        session.info['parents_changed'] = True
+        parent_choices.invalidate()
+
+
+@event.listens_for(Session, 'after_commit')
+@event.listens_for(Session, 'after_rollback')
+def parent_writes_ended(session):
+    if session.info.pop('parents_changed', False):
+        parent_choices.invalidate()
+
+
+@bp.app_template_global()
+def parent_name(id):
+    return parent_choices.name(id)
@@ -0,0 +1,97 @@
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from flask import current_app
+from werkzeug.security import generate_password_hash, check_password_hash
+
+
+class HasherBusy(Exception):
+    pass
+
+
+class PasswordHasher(object):
+    """
+        Runs the password KDF in a bounded process pool so a burst of logins
+        doesn't tie up request threads with CPU-bound hashing. `method` is a
+        full Werkzeug method string (e.g. 'scrypt:32768:8:1' or
+        'pbkdf2:sha256:600000'); hashes stored with any other parameters are
+        reported by needs_rehash(). workers=0 hashes inline. Workers are
+        spawned rather than forked from the threaded server; a broken pool
+        is replaced and the call hashed inline, and a call that waits
+        longer than `timeout` raises HasherBusy and cancels its job if it
+        hasn't started. At most 4 jobs per worker are queued or running.
+    """
+
+    def __init__(self, method='scrypt:32768:8:1', workers=2, timeout=10):
+        self.lock = threading.Lock()
+        self.pool = None
+        self.configure(method, workers, timeout)
+
+    def configure(self, method, workers, timeout):
+        self.method = method
+        self.workers = workers
+        self.timeout = timeout
+        self.slots = threading.BoundedSemaphore(max(workers, 1) * 4)
+        self.prefix = None
+
+    def init_app(self, app):
+        self.configure(app.config['PASSWORD_HASH_METHOD'], app.config['PASSWORD_HASH_WORKERS'],
+                       app.config['PASSWORD_HASH_TIMEOUT'])
+
+    def executor(self):
+        if self.pool is None:
+            with self.lock:
+                if self.pool is None:
+                    self.pool = ProcessPoolExecutor(
+                        self.workers, mp_context=multiprocessing.get_context('spawn'))
+        return self.pool
+
+    def run(self, fn, *args):
+        if not self.workers:
+            return fn(*args)
+        if not self.slots.acquire(timeout=self.timeout):
+            raise HasherBusy()
+        pool = future = None
+        try:
+            pool = self.executor()
+            future = pool.submit(fn, *args)
+            # The slot is held until the job is really finished (or
+            # cancelled), so jobs abandoned on timeout still count.
+            future.add_done_callback(lambda f: self.slots.release())
+            return future.result(self.timeout)
+        except TimeoutError:
+            future.cancel()
+            raise HasherBusy()
+        except BrokenProcessPool:
+            current_app.logger.exception('Password hashing pool broke, hashing inline')
+            with self.lock:
+                if self.pool is pool:
+                    self.pool = None
+            return fn(*args)
+        finally:
+            if future is None:
+                self.slots.release()
+
+    def hash(self, password):
+        return self.run(generate_password_hash, password, self.method)
+
+    def check(self, pwhash, password):
+        if not pwhash:
+            return False
+        return self.run(check_password_hash, pwhash, password)
+
+    def needs_rehash(self, pwhash):
+        # Werkzeug fills in defaults ('pbkdf2:sha256' -> 'pbkdf2:sha256:600000'),
+        # so compare with the prefix of a hash it actually generated.
+        if self.prefix is None:
+            self.prefix = generate_password_hash('', self.method).split('$', 1)[0]
+        return pwhash.split('$', 1)[0] != self.prefix
+
+    def shutdown(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+
+hasher = PasswordHasher()
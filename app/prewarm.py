@@ -0,0 +1,48 @@
+import click
+from time import perf_counter
+from flask import url_for, current_app
+from app import bp
+
+TEMPLATE_EXTENSIONS = ('.html', '.xml', '.txt')
+
+
+def compile_templates(app):
+    """Load every template into the environment cache. Returns the count."""
+    names = app.jinja_env.list_templates(filter_func=lambda n: n.endswith(TEMPLATE_EXTENSIONS))
+    for name in names:
+        app.jinja_env.get_template(name)
+    return len(names)
+
+
+def resolve_routes(app):
+    """Build and match every argument-free GET route. Returns the count."""
+    adapter = app.url_map.bind('localhost')
+    count = 0
+    with app.test_request_context():
+        for rule in app.url_map.iter_rules():
+            if 'GET' in rule.methods and not rule.arguments:
+                adapter.match(url_for(rule.endpoint), 'GET')
+                count += 1
+    return count
+
+
+def prewarm(app):
+    """
+        Compile templates and resolve routes before the worker takes
+        traffic. Returns [(step, count, milliseconds), ...].
+    """
+    timings = []
+    for step, f in [('templates', compile_templates), ('routes', resolve_routes)]:
+        start = perf_counter()
+        count = f(app)
+        timings.append((step, count, (perf_counter() - start) * 1000))
+    app.logger.info('Prewarmed ' + ', '.join('{} {} in {:.1f}ms'.format(count, step, ms)
+                                             for step, count, ms in timings))
+    return timings
+
+
+@bp.cli.command('prewarm')
+def prewarm_command():
+    """Compile all templates and resolve routes, with timings."""
+    for step, count, ms in prewarm(current_app._get_current_object()):
+        click.echo('{}: {} in {:.1f}ms'.format(step, count, ms))
@@ -0,0 +1,129 @@
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from flask import request, g, current_app, has_app_context, has_request_context
+from app import db, query_timing
+
+EXPLAIN = {'sqlite': 'EXPLAIN QUERY PLAN ', 'postgresql': 'EXPLAIN '}
+
+
+class NPlusOneError(Exception):
+    pass
+
+
+class QueryProfile(object):
+    """
+        Statements seen in one request (or one query_profile() block),
+        counted by their SQL text. SQLAlchemy binds values as parameters,
+        so repeats of the same text are the same query shape - typically a
+        lazy load inside a loop.
+    """
+
+    def __init__(self, label, threshold, raise_error=False):
+        self.label = label
+        self.threshold = threshold
+        self.raise_error = raise_error
+        self.counts = Counter()
+        self.flagged = set()
+
+    def record(self, statement):
+        self.counts[statement] += 1
+        count = self.counts[statement]
+        if not self.threshold or count <= self.threshold or statement in self.flagged:
+            return
+        self.flagged.add(statement)
+        message = 'Probable N+1 in {}: statement ran {} times\n{}'.format(
+            self.label, count, statement)
+        if self.raise_error:
+            raise NPlusOneError(message)
+        current_app.logger.warning(message)
+
+
+class QueryLog(object):
+    """
+        Logs statements slower than `slow_ms`, with the database's plan for
+        the first occurrence of each one, and hands every statement run in
+        a request to that request's QueryProfile. Parameters are never
+        logged, since they may hold emails or password hashes.
+    """
+
+    MAX_EXPLAINED = 1000
+
+    def __init__(self, slow_ms=250, explain=True, n_plus_one=10, raise_error=False):
+        self.slow = slow_ms / 1000.0
+        self.explain = explain
+        self.n_plus_one = n_plus_one
+        self.raise_error = raise_error
+        self.explained = set()
+        self.lock = threading.Lock()
+
+    def init_app(self, app):
+        """Configure from the app and, if either check is on, watch its engine."""
+        self.slow = app.config['SLOW_QUERY_MS'] / 1000.0
+        self.explain = app.config['SLOW_QUERY_EXPLAIN']
+        self.n_plus_one = app.config['N_PLUS_ONE_THRESHOLD']
+        self.raise_error = app.config['N_PLUS_ONE_RAISE']
+        if self.slow or self.n_plus_one:
+            with app.app_context():
+                self.install(db.engine)
+
+    def install(self, engine):
+        query_timing.subscribe(engine, self.record)
+
+    def record(self, conn, statement, parameters, executemany, elapsed):
+        if self.slow and elapsed >= self.slow:
+            self.log_slow(conn, statement, parameters, executemany, elapsed)
+        profile = self.current_profile()
+        if profile is not None:
+            profile.record(statement)
+
+    def current_profile(self):
+        if not has_app_context():
+            return None
+        profile = g.get('query_profile')
+        if profile is None and self.n_plus_one and has_request_context():
+            profile = g.query_profile = QueryProfile(
+                request.method + ' ' + request.path, self.n_plus_one, self.raise_error)
+        return profile
+
+    def log_slow(self, conn, statement, parameters, executemany, elapsed):
+        where = request.method + ' ' + request.path if has_request_context() else 'no request'
+        message = 'Slow query ({:.0f} ms, {}):\n{}'.format(elapsed * 1000, where, statement)
+        with self.lock:
+            first = statement not in self.explained and len(self.explained) < self.MAX_EXPLAINED
+            if first:
+                self.explained.add(statement)
+        prefix = EXPLAIN.get(conn.dialect.name)
+        if first and self.explain and prefix and not executemany:
+            message += '\n' + self.plan(conn, prefix + statement, parameters)
+        current_app.logger.warning(message)
+
+    def plan(self, conn, statement, parameters):
+        """The plan from a separate DB-API cursor, so it bypasses these hooks."""
+        cursor = conn.connection.cursor()
+        try:
+            cursor.execute(statement, parameters)
+            return '\n'.join(' | '.join(str(c) for c in row) for row in cursor.fetchall())
+        except Exception as e:
+            return 'EXPLAIN failed: {!r}'.format(e)
+        finally:
+            cursor.close()
+
+
+@contextmanager
+def query_profile(label='block', threshold=None, raise_error=True):
+    """
+        Profile the statements run inside the block, outside a request
+        (tests, shell, CLI). Raises NPlusOneError by default.
+    """
+    profile = QueryProfile(label, threshold or current_app.config['N_PLUS_ONE_THRESHOLD'],
+                           raise_error)
+    previous = g.get('query_profile')
+    g.query_profile = profile
+    try:
+        yield profile
+    finally:
+        g.query_profile = previous
+
+
+query_log = QueryLog()
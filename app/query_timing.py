@@ -0,0 +1,40 @@
+import weakref
+from time import perf_counter
+from sqlalchemy import event
+
+# Per engine, the callbacks handed every statement's timing.
+subscribers = weakref.WeakKeyDictionary()
+
+
+def subscribe(engine, callback):
+    """
+        Call `callback(conn, statement, parameters, executemany, elapsed)`
+        after each statement `engine` runs. Every subscriber shares one
+        pair of cursor hooks, so a statement is timed once however many
+        consumers (metrics, the query log) read it.
+    """
+    callbacks = subscribers.get(engine)
+    if callbacks is None:
+        callbacks = subscribers[engine] = []
+        event.listen(engine, 'before_cursor_execute', before_query)
+        event.listen(engine, 'after_cursor_execute', after_query)
+        event.listen(engine, 'handle_error', query_failed)
+    if callback not in callbacks:
+        callbacks.append(callback)
+
+
+def before_query(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_starts', []).append(perf_counter())
+
+
+def after_query(conn, cursor, statement, parameters, context, executemany):
+    elapsed = perf_counter() - conn.info['query_starts'].pop()
+    for callback in subscribers.get(conn.engine, ()):
+        callback(conn, statement, parameters, executemany, elapsed)
+
+
+def query_failed(exception_context):
+    starts = exception_context.connection.info.get('query_starts') \
+        if exception_context.connection is not None else None
+    if starts:
+        starts.pop()
@@ -0,0 +1,90 @@
+from functools import wraps
+from time import perf_counter, sleep
+from flask import request, render_template, make_response, abort, current_app
+from limits.storage import storage_from_string
+from app import limiter
+
+
+def form_email():
+    return (request.form.get('email') or '').strip().lower()
+
+
+class LoadShedder(object):
+    """
+        Caps how many form submissions run at once across every worker
+        sharing RATELIMIT_STORAGE_URI (one host with sqlite://, one process
+        with memory://). Those requests wait on hCaptcha, Mailjet or
+        password hashing, so when every slot stays busy for `wait` seconds
+        the dependency is saturated and the request gets a 503 with
+        Retry-After instead of queueing behind it. The in-flight count
+        expires `hold` seconds after its last change, so slots held by a
+        killed worker come back once forms go quiet; a release that finds
+        the count expired puts it back to zero rather than below it.
+    """
+
+    KEY = 'load-shed/forms'
+    POLL = 0.05
+
+    def __init__(self, storage=None, limit=8, wait=0.5, retry_after=10, hold=60):
+        self.storage = storage
+        self.limit = limit
+        self.wait = wait
+        self.retry_after = retry_after
+        self.hold = hold
+        self.shed = 0
+
+    def init_app(self, app):
+        self.storage = storage_from_string(app.config['RATELIMIT_STORAGE_URI'])
+        self.limit = app.config['FORM_CONCURRENCY']
+        self.wait = app.config['FORM_CONCURRENCY_WAIT']
+        self.retry_after = app.config['FORM_RETRY_AFTER']
+
+    def change(self, amount):
+        return self.storage.incr(self.KEY, self.hold, elastic_expiry=True, amount=amount)
+
+    def release(self):
+        if self.change(-1) < 0:
+            self.change(1)
+
+    def acquire(self):
+        deadline = perf_counter() + self.wait
+        while True:
+            if self.change(1) <= self.limit:
+                return True
+            self.release()
+            if perf_counter() >= deadline:
+                return False
+            sleep(self.POLL)
+
+    def in_flight(self):
+        return max(self.storage.get(self.KEY), 0)
+
+    def __call__(self, f):
+        @wraps(f)
+        def wrap(*args, **kwargs):
+            if request.method != 'POST':
+                return f(*args, **kwargs)
+            if not self.acquire():
+                self.shed += 1
+                response = make_response(render_template('errors/503.html'), 503)
+                response.headers['Retry-After'] = str(self.retry_after)
+                abort(response)
+            try:
+                return f(*args, **kwargs)
+            finally:
+                self.release()
+        return wrap
+
+
+shed_load = LoadShedder()
+
+
+def form_limits(f):
+    """
+        Per-IP and per-email rate limits plus the load shedder for a form
+        endpoint. Only POSTs count; rendering the form is free.
+    """
+    f = shed_load(f)
+    f = limiter.limit(lambda: current_app.config['RATELIMIT_FORM_EMAIL'], key_func=form_email,
+                      methods=['POST'], exempt_when=lambda: not form_email())(f)
+    return limiter.limit(lambda: current_app.config['RATELIMIT_FORM_IP'], methods=['POST'])(f)
@@ -1,30 +1,34 @@
 import os
 from flask import Flask, render_template, flash, Markup, redirect, url_for, \
-    request, send_from_directory, send_file, make_response
-from app import app, db, login, hcaptcha
+    request, send_from_directory, send_file, make_response, jsonify, abort, current_app
+from app import bp, db, login
 from app.forms import ContactForm, EmailListForm, SignupForm, LoginForm, UserForm, \
-    RequestPasswordResetForm, ResetPasswordForm
+    RequestPasswordResetForm, ResetPasswordForm, BroadcastForm
 from flask_login import current_user, login_user, logout_user, login_required, login_url
-from app.models import User
+from app.models import User, DIRECTORY_SECTIONS, directory_page, directory_counts
 from werkzeug.urls import url_parse
 from datetime import datetime
+from app.last_seen import last_seen
+from app.parents import parent_choices
+from app.sitemap import get_sitemap
+from app.page_cache import cached_page
+from app.search import search_users
+from app.rate_limits import form_limits
+from app.captcha import captcha
 from app.email import send_contact_email, send_verification_email, send_password_reset_email
+from app import broadcast as broadcasts
 from functools import wraps
+from itertools import groupby
+from operator import itemgetter
 
-@app.before_request
+@bp.before_app_request
 def before_request():
+    if request.endpoint in ('static', 'main.hashed_static'):
+        return
     if current_user.is_authenticated:
-        current_user.last_viewed = datetime.utcnow()
-        db.session.commit()
-
-def dir_last_updated(folder):
-    return str(max(os.path.getmtime(os.path.join(root_path, f))
-                   for root_path, dirs, files in os.walk(folder)
-                   for f in files))
-
-@app.context_processor
-def inject_values():
-    return dict(last_updated=dir_last_updated('app/static'))
+        last_seen.touch(current_user.id)
+    if last_seen.due():
+        last_seen.flush()
 
 def admin_required(f):
     @login_required
@@ -35,43 +39,44 @@ def admin_required(f):
         else:
             flash('You must have administrator privileges to access this page.', 'error')
             logout_user()
-            return redirect(login_url('signin', next_url=request.url))
+            return redirect(login_url('main.signin', next_url=request.url))
     return wrap
 
 
-@app.route('/', methods=['GET', 'POST'])
-@app.route('/index', methods=['GET', 'POST'])
+@bp.route('/', methods=['GET', 'POST'])
+@bp.route('/index', methods=['GET', 'POST'])
+@form_limits
 def index():
     form = ContactForm()
     if form.validate_on_submit():
-        if hcaptcha.verify():
+        if captcha.verify():
             pass
         else:
             flash('A computer has questioned your humanity. Please try again.', 'error')
-            return redirect(url_for('home'))
+            return redirect(url_for('main.index', _anchor='contact'))
         user = User(first_name=form.first_name.data, email=form.email.data, phone=form.phone.data)
         message = form.message.data
         subject = form.subject.data
-        email_status = send_contact_email(user, message)
-        if email_status == 200:
+        if send_contact_email(user, message):
             flash('Please check ' + user.email + ' for a confirmation email. Thank you for reaching out!')
-            return redirect(url_for('index', _anchor="home"))
+            return redirect(url_for('main.index', _anchor="home"))
         else:
             flash('Email failed to send, please contact ' + hello, 'error')
     return render_template('index.html', form=form)
 
 
-@app.route('/signin', methods=['GET', 'POST'])
+@bp.route('/signin', methods=['GET', 'POST'])
 def signin():
     if current_user.is_authenticated:
         flash('You are already signed in.')
-        return redirect(url_for('start_page'))
+        return redirect(url_for('main.start_page'))
     form = LoginForm()
     signup_form = SignupForm()
     return render_template('signin.html', title='Sign in', form=form, signup_form=signup_form)
 
 
-@app.route('/signup', methods=['GET', 'POST'])
+@bp.route('/signup', methods=['GET', 'POST'])
+@form_limits
 def signup():
     form = LoginForm()
     signup_form = SignupForm()
@@ -81,60 +86,62 @@ def signup():
         user.set_password(signup_form.password.data)
         db.session.add(user)
         db.session.commit()
-        email_status = send_verification_email(user)
+        email_queued = send_verification_email(user)
         login_user(user)
-        if email_status == 200:
+        if email_queued:
             flash("Welcome! Please check your inbox to verify your email.")
         else:
             flash('Verification email failed to send, please contact ' + hello, 'error')
         next = request.args.get('next')
         if not next or url_parse(next).netloc != '':
-            return redirect(url_for('start_page'))
+            return redirect(url_for('main.start_page'))
         return redirect(next)
     return render_template('signin.html', title='Sign in', form=form, signup_form=signup_form)
 
 
-@app.route('/login', methods=['GET', 'POST'])
+@bp.route('/login', methods=['GET', 'POST'])
+@form_limits
 def login():
     if current_user.is_authenticated:
         flash('You are already signed in.')
-        return redirect(url_for('start_page'))
+        return redirect(url_for('main.start_page'))
     form = LoginForm()
     signup_form = SignupForm()
     if form.validate_on_submit():
         user = User.query.filter_by(email=form.email.data).first()
         if user is None or not user.check_password(form.password.data):
             flash('Invalid username or password')
-            return redirect(url_for('signin'))
+            return redirect(url_for('main.signin'))
+        if db.session.is_modified(user):
+            db.session.commit()
         login_user(user)
         if user.is_verified != True:
-            email_status = send_verification_email(user)
-            if email_status == 200:
+            if send_verification_email(user):
                 flash('Please check your inbox to verify your email.')
             else:
                 flash('Verification email did not send. Please contact ' + hello)
         next = request.args.get('next')
         if not next or url_parse(next).netloc != '':
-            return redirect(url_for('start_page'))
+            return redirect(url_for('main.start_page'))
         return redirect(next)
     return render_template('signin.html', title='Sign in', form=form, signup_form=signup_form)
 
 
-@app.route('/logout')
+@bp.route('/logout')
 def logout():
     logout_user()
-    return redirect(url_for('signin'))
+    return redirect(url_for('main.signin'))
 
 
-@app.route('/start-page')
+@bp.route('/start-page')
 def start_page():
     if current_user.is_admin:
-        return redirect(url_for('users'))
+        return redirect(url_for('main.users'))
     else:
-        return redirect(url_for('home'))
+        return redirect(url_for('main.home'))
 
 
-@app.route('/verify-email/<token>', methods=['GET', 'POST'])
+@bp.route('/verify-email/<token>', methods=['GET', 'POST'])
 def verify_email(token):
     logout_user()
     user = User.verify_email_token(token)
@@ -144,40 +151,40 @@ def verify_email(token):
         db.session.add(user)
         db.session.commit()
         flash('Thank you for verifying your account.')
-        return redirect(url_for('start_page'))
+        return redirect(url_for('main.start_page'))
     else:
         flash('Your verification link is expired or invalid. Log in to receive a new link.')
-        return redirect(url_for('signin'))
+        return redirect(url_for('main.signin'))
 
 
-@app.route('/request-password-reset', methods=['GET', 'POST'])
+@bp.route('/request-password-reset', methods=['GET', 'POST'])
+@form_limits
 def request_password_reset():
     form = RequestPasswordResetForm()
     if form.validate_on_submit():
-        if hcaptcha.verify():
+        if captcha.verify():
             pass
         else:
             flash('A computer has questioned your humanity. Please try again.', 'error')
-            return redirect(url_for('request_password_reset'))
+            return redirect(url_for('main.request_password_reset'))
         user = User.query.filter_by(email=form.email.data).first()
         if user:
-            email_status = send_password_reset_email(user)
-            if email_status == 200:
+            if send_password_reset_email(user):
                 flash('Check your email for instructions to reset your password.')
             else:
                 flash('Email failed to send, please contact ' + hello, 'error')
         else:
             flash('Check your email for instructions to reset your password')
-        return redirect(url_for('signin'))
+        return redirect(url_for('main.signin'))
     return render_template('request-password-reset.html', title='Reset password', form=form)
 
 
-@app.route('/set-password/<token>', methods=['GET', 'POST'])
+@bp.route('/set-password/<token>', methods=['GET', 'POST'])
 def set_password(token):
     user = User.verify_email_token(token)
     if not user:
         flash('The password reset link is expired or invalid. Please try again.')
-        return redirect(url_for('request_password_reset'))
+        return redirect(url_for('main.request_password_reset'))
     form = ResetPasswordForm()
     if form.validate_on_submit():
         user.set_password(form.password.data)
@@ -185,21 +192,15 @@ def set_password(token):
         db.session.commit()
         login_user(user)
         flash('Your password has been saved.')
-        return redirect(url_for('start_page'))
+        return redirect(url_for('main.start_page'))
     return render_template('set-password.html', form=form)
 
 
-@app.route('/users', methods=['GET', 'POST'])
+@bp.route('/users', methods=['GET', 'POST'])
 @admin_required
 def users():
     form = UserForm(None)
-    roles = ['parent', 'student', 'admin']
-    active_users = User.query.order_by(User.first_name).filter((User.status == 'active'))
-    other_users = User.query.order_by(User.first_name).filter((User.status != 'active') | (User.status == None) | \
-        (User.role.notin_(roles)) | (User.role == None))
-    parents = User.query.filter_by(role='parent')
-    parent_list = [(0,'')]+[(u.id, u.first_name + " " + u.last_name) for u in parents]
-    form.parent_id.choices = parent_list
+    form.parent_id.choices = parent_choices.select_choices(request.form.get('parent_id', type=int))
     if form.validate_on_submit():
         user = User(first_name=form.first_name.data, last_name=form.last_name.data, \
             email=form.email.data, phone=form.phone.data, location=form.location.data, \
@@ -219,20 +220,21 @@ def users():
         except:
             db.session.rollback()
             flash(user.first_name + ' could not be added', 'error')
-            return redirect(url_for('users'))
-        return redirect(url_for('users'))
-    return render_template('users.html', title="Users", form=form, active_users=active_users, \
-        other_users=other_users, roles=roles)
+            return redirect(url_for('main.users'))
+        return redirect(url_for('main.users'))
+    rows, next_cursor = directory_page(request.args.get('after'), current_app.config['USERS_PER_PAGE'])
+    sections = [(section, [u for _, u in group]) for section, group in groupby(rows, key=itemgetter(0))]
+    return render_template('users.html', title="Users", form=form, sections=sections, \
+        section_titles=DIRECTORY_SECTIONS, counts=directory_counts(), next_cursor=next_cursor, \
+        first_page='after' not in request.args, parent_typeahead=parent_typeahead(form))
 
 
-@app.route('/edit-user/<int:id>', methods=['GET', 'POST'])
+@bp.route('/edit-user/<int:id>', methods=['GET', 'POST'])
 @admin_required
 def edit_user(id):
     user = User.query.get_or_404(id)
     form = UserForm(user.email, obj=user)
-    parents = User.query.order_by(User.first_name).filter_by(role='parent')
-    parent_list = [(0,'')]+[(u.id, u.first_name + " " + u.last_name) for u in parents]
-    form.parent_id.choices = parent_list
+    form.parent_id.choices = parent_choices.select_choices(request.form.get('parent_id', type=int))
     if form.validate_on_submit():
         if 'save' in request.form:
             user.first_name=form.first_name.data
@@ -255,14 +257,14 @@ def edit_user(id):
             except:
                 db.session.rollback()
                 flash(user.first_name + ' could not be updated', 'error')
-                return redirect(url_for('users'))
+                return redirect(url_for('main.users'))
         elif 'delete' in request.form:
             db.session.delete(user)
             db.session.commit()
             flash('Deleted ' + user.first_name)
         else:
             flash('Code error in POST request', 'error')
-        return redirect(url_for('users'))
+        return redirect(url_for('main.users'))
     elif request.method == "GET":
         form.first_name.data=user.first_name
         form.last_name.data=user.last_name
@@ -273,86 +275,143 @@ def edit_user(id):
         form.role.data=user.role
         form.parent_id.data=user.parent_id
         form.is_admin.data=user.is_admin
-    return render_template('edit-user.html', title='Edit User', form=form, user=user)
+    return render_template('edit-user.html', title='Edit User', form=form, user=user, \
+        parent_typeahead=parent_typeahead(form))
+
+
+def parent_typeahead(form):
+    return len(form.parent_id.choices) > current_app.config['PARENT_TYPEAHEAD_THRESHOLD']
+
+
+@bp.route('/users/parents')
+@admin_required
+def parent_search():
+    matches = parent_choices.search(request.args.get('q', ''))
+    return jsonify([{'id': id, 'name': name} for id, name in matches])
+
+
+@bp.route('/users/search')
+@admin_required
+def user_search():
+    page = request.args.get('page', 1, type=int)
+    matches, has_next = search_users(request.args.get('q', ''), page,
+                                     current_app.config['USER_SEARCH_PER_PAGE'])
+    return jsonify({'page': page, 'next_page': page + 1 if has_next else None,
+        'users': [{'id': u.id, 'name': ' '.join(n for n in (u.first_name, u.last_name) if n),
+                   'email': u.email, 'phone': u.phone, 'role': u.role,
+                   'url': url_for('main.edit_user', id=u.id)} for u in matches]})
+
+
+@bp.route('/users/broadcast', methods=['GET', 'POST'])
+@admin_required
+def broadcast():
+    form = BroadcastForm()
+    if form.validate_on_submit():
+        running = broadcasts.last_broadcast
+        if running and running.stats()['running']:
+            flash('A broadcast is already being sent.', 'error')
+        else:
+            broadcasts.start_broadcast(broadcasts.Broadcast(form.subject.data, \
+                form.message.data, role=form.role.data or None, status=form.status.data or None, \
+                max_failures=current_app.config['BROADCAST_MAX_FAILURES']))
+            flash('Broadcast started')
+        return redirect(url_for('main.broadcast'))
+    return render_template('broadcast.html', title='Email users', form=form, \
+        broadcast=broadcasts.last_broadcast)
 
 
-@app.route("/download/<filename>")
+@bp.route("/download/<filename>")
 def download_file (filename):
-    path = os.path.join(app.root_path, 'static/files/')
+    path = os.path.join(current_app.root_path, 'static/files/')
     return send_from_directory(path, filename, as_attachment=False)
 
-@app.route('/favicon.ico')
+@bp.route('/favicon.ico')
 def favicon():
-    return send_from_directory(os.path.join(app.root_path, 'static'), 'img/favicons/favicon.ico')
+    return send_from_directory(os.path.join(current_app.root_path, 'static'), 'img/favicons/favicon.ico')
 
-@app.route('/manifest.webmanifest')
+@bp.route('/manifest.webmanifest')
 def webmanifest():
-    return send_from_directory(os.path.join(app.root_path, 'static'), 'img/favicons/manifest.webmanifest')
+    return send_from_directory(os.path.join(current_app.root_path, 'static'), 'img/favicons/manifest.webmanifest')
 
-@app.route('/robots.txt')
+@bp.route('/robots.txt')
 def static_from_root():
-    return send_from_directory(app.static_folder, request.path[1:])
+    return send_from_directory(current_app.static_folder, request.path[1:])
 
-@app.route("/sitemap")
-@app.route("/sitemap/")
-@app.route("/sitemap.xml")
+@bp.route("/sitemap")
+@bp.route("/sitemap/")
+@bp.route("/sitemap.xml")
 def sitemap():
     """
-        Route to dynamically generate a sitemap of your website/application.
-        lastmod and priority tags omitted on static pages.
-        lastmod included on dynamic content such as blog posts.
+        Sitemap of the site's GET pages plus any dynamic content registered
+        with app.sitemap.sitemap_urls. Rendered once per host and served
+        with ETag/Last-Modified; becomes a sitemap index past 50k URLs.
     """
-    #from urllib.parse import urlparse
+    return sitemap_response(get_sitemap(host_base()).root)
+
+
+@bp.route("/sitemap.xml.gz")
+def sitemap_gzip():
+    return sitemap_response(get_sitemap(host_base()).root, gzipped=True)
 
+
+@bp.route("/sitemap-<int:page>.xml")
+def sitemap_page(page):
+    document = get_sitemap(host_base()).page(page)
+    if document is None:
+        abort(404)
+    return sitemap_response(document)
+
+
+def host_base():
     host_components = url_parse(request.host_url)
-    host_base = host_components.scheme + "://" + host_components.netloc
-
-    # Static routes with static content
-    static_urls = list()
-    for rule in app.url_map.iter_rules():
-        if not str(rule).startswith("/admin") and not str(rule).startswith("/user"):
-            if "GET" in rule.methods and len(rule.arguments) == 0:
-                url = {
-                    "loc": f"{host_base}{str(rule)}"
-                }
-                static_urls.append(url)
-
-    # # Dynamic routes with dynamic content
-    # dynamic_urls = list()
-    # blog_posts = Post.objects(published=True)
-    # for post in blog_posts:
-    #     url = {
-    #         "loc": f"{host_base}/blog/{post.category.name}/{post.url}",
-    #         "lastmod": post.date_published.strftime("%Y-%m-%dT%H:%M:%SZ")
-    #         }
-    #     dynamic_urls.append(url)
-
-    xml_sitemap = render_template('sitemap/sitemap.xml', static_urls=static_urls, host_base=host_base) #dynamic_urls=dynamic_urls)
-    response = make_response(xml_sitemap)
-    response.headers["Content-Type"] = "application/xml"
-
-    return response
-
-
-def TemplateRenderer(app):
+    return host_components.scheme + "://" + host_components.netloc
+
+
+def sitemap_response(document, gzipped=False):
+    if gzipped:
+        response = make_response(document.gzipped)
+        response.headers["Content-Type"] = "application/gzip"
+        response.set_etag(document.etag + '-gz')
+    else:
+        response = make_response(document.xml)
+        response.headers["Content-Type"] = "application/xml"
+        response.set_etag(document.etag)
+    response.last_modified = document.modified
+    response.cache_control.public = True
+    response.cache_control.max_age = current_app.config['SITEMAP_MAX_AGE']
+    return response.make_conditional(request)
+
+
+def TemplateRenderer(state):
     def register_template_endpoint(name, endpoint):
-        @app.route('/' + name, endpoint=endpoint)
+        @cached_page
         def route_handler():
             title = name.replace('-', ' ').capitalize()
             return render_template(name + '.html', title=title)
+        state.add_url_rule('/' + name, endpoint, route_handler)
     return register_template_endpoint
 
-endpoints = []
-for r in app.url_map._rules:
-    endpoints.append(r.endpoint)
 
-template_list = []
-for f in os.listdir('app/templates'):
-    if f.endswith('html') and not f.startswith('_'):
-        template_list.append(f[0:-5])
-
-register_template_endpoint = TemplateRenderer(app)
-for path in template_list:
-    endpoint = path.replace('-','_')
-    if endpoint not in endpoints:
-        register_template_endpoint(path, endpoint)
+@bp.record
+def register_template_pages(state):
+    """
+        A route for each page template that no view above renders. Their
+        paths are kept in app.extensions['template_pages'].
+    """
+    app = state.app
+    endpoints = []
+    for r in app.url_map.iter_rules():
+        endpoints.append(r.endpoint)
+
+    template_list = []
+    for f in os.listdir(os.path.join(app.root_path, app.template_folder)):
+        if f.endswith('html') and not f.startswith('_'):
+            template_list.append(f[0:-5])
+
+    register_template_endpoint = TemplateRenderer(state)
+    pages = app.extensions.setdefault('template_pages', [])
+    for path in template_list:
+        endpoint = path.replace('-','_')
+        if bp.name + '.' + endpoint not in endpoints:
+            register_template_endpoint(path, endpoint)
+            pages.append('/' + path)
@@ -0,0 +1,111 @@
+import re
+import weakref
+import click
+from sqlalchemy import text, inspect, or_
+from app import db
+from app.models import User
+from app.bulk_users import users as users_cli
+
+SEARCH_FIELDS = ('first_name', 'last_name', 'email', 'phone', 'location')
+WORD = re.compile(r'\w+', re.UNICODE)
+
+# The index is kept in sync by triggers on the user table. A render_as_batch
+# migration that rebuilds 'user' (copy, drop, rename) drops those triggers,
+# so such a migration must recreate them, e.g. with create_search_index().
+SEARCH_INDEX_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS user_search USING fts5(
+        first_name, last_name, email, phone, location,
+        content='user', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3')""",
+    """CREATE TRIGGER IF NOT EXISTS user_search_insert AFTER INSERT ON user BEGIN
+        INSERT INTO user_search(rowid, first_name, last_name, email, phone, location)
+        VALUES (new.id, new.first_name, new.last_name, new.email, new.phone, new.location);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS user_search_delete AFTER DELETE ON user BEGIN
+        INSERT INTO user_search(user_search, rowid, first_name, last_name, email, phone, location)
+        VALUES ('delete', old.id, old.first_name, old.last_name, old.email, old.phone, old.location);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS user_search_update
+        AFTER UPDATE OF first_name, last_name, email, phone, location ON user BEGIN
+        INSERT INTO user_search(user_search, rowid, first_name, last_name, email, phone, location)
+        VALUES ('delete', old.id, old.first_name, old.last_name, old.email, old.phone, old.location);
+        INSERT INTO user_search(rowid, first_name, last_name, email, phone, location)
+        VALUES (new.id, new.first_name, new.last_name, new.email, new.phone, new.location);
+    END""",
+]
+DROP_SEARCH_INDEX_DDL = [
+    'DROP TRIGGER IF EXISTS user_search_update',
+    'DROP TRIGGER IF EXISTS user_search_delete',
+    'DROP TRIGGER IF EXISTS user_search_insert',
+    'DROP TABLE IF EXISTS user_search',
+]
+
+# Whether each engine has the index; checked once, reset by 'users reindex'.
+fts_engines = weakref.WeakKeyDictionary()
+
+
+def create_search_index(connection):
+    """Create the FTS5 table and its sync triggers, then index every user."""
+    for statement in SEARCH_INDEX_DDL:
+        connection.execute(text(statement))
+    connection.execute(text("INSERT INTO user_search(user_search) VALUES ('rebuild')"))
+
+
+def drop_search_index(connection):
+    for statement in DROP_SEARCH_INDEX_DDL:
+        connection.execute(text(statement))
+
+
+def fts_available():
+    """True when the database is SQLite and has the user_search table."""
+    engine = db.engine
+    available = fts_engines.get(engine)
+    if available is None:
+        available = fts_engines[engine] = \
+            engine.dialect.name == 'sqlite' and inspect(engine).has_table('user_search')
+    return available
+
+
+def fts_query(words):
+    """Every word as a quoted prefix term, so user input can't inject FTS syntax."""
+    return ' '.join('"' + word.replace('"', '""') + '"*' for word in words)
+
+
+def search_users(q, page=1, per_page=25):
+    """
+        Users matching every word of `q` in name, email, phone or location,
+        best matches first. Uses the FTS5 index on SQLite and LIKE
+        elsewhere. Returns (users, has_next).
+    """
+    words = WORD.findall(q.lower())
+    if not words:
+        return [], False
+    offset = (max(page, 1) - 1) * per_page
+    if fts_available():
+        ids = db.session.execute(text(
+            'SELECT rowid FROM user_search WHERE user_search MATCH :q '
+            'ORDER BY rank LIMIT :limit OFFSET :offset'),
+            {'q': fts_query(words), 'limit': per_page + 1, 'offset': offset}).scalars().all()
+        found = {u.id: u for u in User.query.filter(User.id.in_(ids[:per_page]))}
+        users = [found[id] for id in ids[:per_page] if id in found]
+    else:
+        query = User.query
+        for word in words:
+            pattern = '%' + word.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+            query = query.filter(or_(*[getattr(User, f).ilike(pattern, escape='\\')
+                                       for f in SEARCH_FIELDS]))
+        ids = query.order_by(User.first_name, User.id).offset(offset).limit(per_page + 1).all()
+        users = ids[:per_page]
+    return users, len(ids) > per_page
+
+
+@users_cli.command('reindex')
+def reindex():
+    """Recreate the SQLite user search index and its triggers."""
+    if db.engine.dialect.name != 'sqlite':
+        click.echo('Full-text search needs SQLite; other databases use LIKE.')
+        return
+    with db.engine.begin() as connection:
+        create_search_index(connection)
+    fts_engines.pop(db.engine, None)
+    click.echo('Indexed ' + str(User.query.count()) + ' users.')
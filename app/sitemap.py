@@ -0,0 +1,114 @@
+import gzip
+import hashlib
+import threading
+from datetime import datetime
+from cachetools import LRUCache
+from flask import render_template, url_for, current_app, has_app_context
+
+SITEMAP_LIMIT = 50000
+
+url_providers = []
+sitemaps_lock = threading.Lock()
+
+
+def sitemap_urls(f):
+    """
+        Register a function returning dynamic sitemap entries for a host,
+        e.g. blog posts:
+
+            @sitemap_urls
+            def blog_urls(host_base):
+                for post in Post.query.filter_by(published=True):
+                    yield {"loc": f"{host_base}/blog/{post.url}",
+                           "lastmod": post.date_published.strftime("%Y-%m-%dT%H:%M:%SZ")}
+
+        Call invalidate_sitemaps() when that content changes.
+    """
+    url_providers.append(f)
+    invalidate_sitemaps()
+    return f
+
+
+def init_app(app):
+    app.extensions['sitemaps'] = LRUCache(maxsize=16)
+
+
+def invalidate_sitemaps():
+    """Drop the current app's rendered sitemaps, if there is an app."""
+    if has_app_context():
+        with sitemaps_lock:
+            current_app.extensions['sitemaps'].clear()
+
+
+class SitemapDocument(object):
+    def __init__(self, xml, modified):
+        self.xml = xml.encode('utf-8')
+        self.etag = hashlib.md5(self.xml).hexdigest()
+        self.gzipped = gzip.compress(self.xml, mtime=0)
+        self.modified = modified
+
+
+class Sitemap(object):
+    """
+        Rendered sitemap for one host. Up to SITEMAP_LIMIT entries go in a
+        single urlset; beyond that the entries are split into numbered
+        pages and the root document is a sitemap index.
+    """
+
+    def __init__(self, host_base, limit=SITEMAP_LIMIT):
+        self.modified = datetime.utcnow().replace(microsecond=0)
+        static_urls = [{"loc": host_base + path} for path in static_paths()]
+        dynamic_urls = [url for provider in url_providers for url in provider(host_base)]
+        total = len(static_urls) + len(dynamic_urls)
+
+        self.pages = []
+        if total <= limit:
+            self.root = self.render_urlset(static_urls, dynamic_urls)
+            return
+        entries = static_urls + dynamic_urls
+        for start in range(0, total, limit):
+            chunk = entries[start:start + limit]
+            self.pages.append(self.render_urlset(
+                [u for u in chunk if "lastmod" not in u],
+                [u for u in chunk if "lastmod" in u]))
+        locs = [host_base + url_for('main.sitemap_page', page=i + 1)
+                for i in range(len(self.pages))]
+        self.root = SitemapDocument(render_template('sitemap/sitemap-index.xml',
+            sitemaps=locs, lastmod=self.modified.strftime("%Y-%m-%dT%H:%M:%SZ")), self.modified)
+
+    def render_urlset(self, static_urls, dynamic_urls):
+        return SitemapDocument(render_template('sitemap/sitemap.xml',
+            static_urls=static_urls, dynamic_urls=dynamic_urls), self.modified)
+
+    def page(self, page):
+        if page < 1 or page > len(self.pages):
+            return None
+        return self.pages[page - 1]
+
+
+def static_paths():
+    """GET routes without arguments, excluding admin, user, sitemap and metrics pages."""
+    paths = set()
+    for rule in current_app.url_map.iter_rules():
+        if not str(rule).startswith(("/admin", "/user", "/sitemap", "/metrics")):
+            if "GET" in rule.methods and len(rule.arguments) == 0:
+                paths.add(str(rule))
+    return sorted(paths)
+
+
+def get_sitemap(host_base):
+    sitemaps = current_app.extensions['sitemaps']
+    with sitemaps_lock:
+        sitemap = sitemaps.get(host_base)
+    if sitemap is None:
+        sitemap = Sitemap(host_base)
+        with sitemaps_lock:
+            sitemaps[host_base] = sitemap
+    return sitemap
+
+
+def build_sitemaps(app, hosts):
+    """Render sitemaps for known hosts ahead of the first request."""
+    for host_base in hosts:
+        with app.test_request_context(base_url=host_base):
+            get_sitemap(host_base.rstrip('/'))
@@ -0,0 +1,216 @@
+import os
+import re
+import glob
+import gzip
+import json
+import hashlib
+import click
+from flask import current_app
+from app.assets import assets
+
+TOKEN = re.compile(r'[A-Za-z0-9_-]+')
+SELECTOR_NAME = re.compile(r'[.#](-?[_a-zA-Z][\w-]*)')
+PSEUDO_ARGUMENT = re.compile(r':(?:not|is|where|has)\([^()]*\)')
+ATTRIBUTE = re.compile(r'\[[^\]]*\]')
+COMMENT = re.compile(r'/\*.*?\*/', re.S)
+KEEP_AT_RULES = ('@font-face', '@keyframes', '@-webkit-keyframes', '@page', '@property')
+TAG = re.compile(r'(?:^|[\s>+~])([a-zA-Z][\w-]*)')
+ATTRIBUTE_NAME = re.compile(r'\[\s*([\w-]+)')
+CUSTOM_PROPERTY = re.compile(r'(--[\w-]+)\s*:([^;{}]*);?')
+VAR = re.compile(r'var\(\s*(--[\w-]+)')
+EMPTY_RULE = re.compile(r'[^{};]+\{\s*\}')
+CSS_IMPORT = re.compile(r'@import\s+(?:url\()?["\']?([^"\')]+\.css)["\']?\)?\s*;')
+URL = re.compile(r'url\(\s*(["\']?)([^"\')]+)\1\s*\)')
+
+
+def used_tokens(root, patterns, safelist=()):
+    """Every word-like token in the template, script and Python sources."""
+    tokens = set(safelist)
+    for pattern in patterns:
+        for path in glob.glob(os.path.join(root, pattern), recursive=True):
+            with open(path, encoding='utf-8') as f:
+                tokens.update(TOKEN.findall(f.read()))
+    return tokens
+
+
+def inline_imports(css, base_dir):
+    """Replace @import of local .css files with their contents."""
+    def replace(match):
+        path = os.path.join(base_dir, match.group(1))
+        if not os.path.exists(path):
+            return match.group(0)
+        with open(path, encoding='utf-8') as f:
+            return rebase_urls(f.read(), os.path.dirname(path), base_dir)
+    return CSS_IMPORT.sub(replace, css)
+
+
+def rebase_urls(css, from_dir, to_dir, prefix=''):
+    """Rewrite relative url() references for a stylesheet moved to `to_dir`."""
+    def replace(match):
+        url = match.group(2)
+        if url.startswith(('data:', 'http:', 'https:', '//', '/', '#')):
+            return match.group(0)
+        path = os.path.relpath(os.path.normpath(os.path.join(from_dir, url)), to_dir)
+        return 'url(' + prefix + path.replace(os.sep, '/') + ')'
+    return URL.sub(replace, css)
+
+
+def split_blocks(css):
+    """
+        Split a stylesheet into top-level (prelude, body) pairs. Statements
+        without a block (e.g. @charset) have body None.
+    """
+    blocks = []
+    depth = 0
+    start = 0
+    prelude = None
+    for i, char in enumerate(css):
+        if char == '{':
+            if depth == 0:
+                prelude = css[start:i].strip()
+                start = i + 1
+            depth += 1
+        elif char == '}':
+            depth -= 1
+            if depth == 0:
+                blocks.append((prelude, css[start:i]))
+                start = i + 1
+        elif char == ';' and depth == 0:
+            statement = css[start:i].strip()
+            if statement:
+                blocks.append((statement, None))
+            start = i + 1
+    return blocks
+
+
+def split_selectors(prelude):
+    selectors, depth, start = [], 0, 0
+    for i, char in enumerate(prelude):
+        if char in '([':
+            depth += 1
+        elif char in ')]':
+            depth -= 1
+        elif char == ',' and depth == 0:
+            selectors.append(prelude[start:i].strip())
+            start = i + 1
+    selectors.append(prelude[start:].strip())
+    return selectors
+
+
+def selector_used(selector, tokens, tags=None, attributes=None):
+    """
+        True if every class and id in `selector` is in `tokens` and, when
+        `tags`/`attributes` are given, every element and attribute name it
+        mentions is among them.
+    """
+    bare = PSEUDO_ARGUMENT.sub('', selector)
+    names = SELECTOR_NAME.findall(ATTRIBUTE.sub('', bare))
+    if not all(name in tokens for name in names):
+        return False
+    if tags is not None:
+        elements = TAG.findall(SELECTOR_NAME.sub('', ATTRIBUTE.sub('', bare)))
+        if not all(tag.lower() in tags for tag in elements):
+            return False
+    if attributes is not None:
+        if not all(name.lower() in attributes for name in ATTRIBUTE_NAME.findall(bare)):
+            return False
+    return True
+
+
+def purge(css, tokens, tags=None, attributes=None):
+    """
+        Drop rules whose selectors only match classes or ids nobody uses
+        (and, if given, elements or attributes that don't occur).
+    """
+    out = []
+    for prelude, body in split_blocks(COMMENT.sub('', css)):
+        if body is None:
+            out.append(prelude + ';')
+        elif prelude.startswith(KEEP_AT_RULES):
+            out.append(prelude + '{' + body + '}')
+        elif prelude.startswith('@'):
+            inner = purge(body, tokens, tags, attributes)
+            if inner.strip():
+                out.append(prelude + '{' + inner + '}')
+        else:
+            selectors = [s for s in split_selectors(prelude)
+                         if selector_used(s, tokens, tags, attributes)]
+            if selectors:
+                out.append(','.join(selectors) + '{' + body + '}')
+    return '\n'.join(out)
+
+
+def prune_custom_properties(css):
+    """
+        Drop custom property declarations (e.g. Bootstrap's :root --bs-*)
+        that no var() in the stylesheet refers to, directly or through
+        another property, then any rules left empty.
+    """
+    definitions = {}
+    for name, value in CUSTOM_PROPERTY.findall(css):
+        definitions.setdefault(name, []).append(value)
+    used = set(VAR.findall(CUSTOM_PROPERTY.sub('', css)))
+    pending = list(used)
+    while pending:
+        for value in definitions.get(pending.pop(), ()):
+            for name in VAR.findall(value):
+                if name not in used:
+                    used.add(name)
+                    pending.append(name)
+    css = CUSTOM_PROPERTY.sub(lambda m: m.group(0) if m.group(1) in used else '', css)
+    while True:
+        pruned = EMPTY_RULE.sub('', css)
+        if pruned == css:
+            return css
+        css = pruned
+
+
+def compile_stylesheet(source, output_dir, content, safelist):
+    try:
+        import sass
+    except ImportError:
+        raise click.UsageError('Building stylesheets requires libsass (pip install libsass).')
+
+    source_dir = os.path.dirname(source)
+    compiled = sass.compile(filename=source, output_style='expanded')
+    compiled = rebase_urls(inline_imports(compiled, source_dir), source_dir, output_dir)
+    purged = purge(compiled, used_tokens(current_app.root_path, content, safelist))
+    minified = sass.compile(string=purged, output_style='compressed')
+    return compiled, purged, minified
+
+
+@assets.command('css')
+def build_css():
+    """Compile, purge and minify custom.scss into a content-hashed file."""
+    source = current_app.config['CSS_SOURCE']
+    output = os.path.join(current_app.static_folder, current_app.config['CSS_BUILD_DIR'])
+    compiled, purged, minified = compile_stylesheet(
+        os.path.join(current_app.static_folder, source), output,
+        current_app.config['CSS_PURGE_CONTENT'], current_app.config['CSS_PURGE_SAFELIST'])
+
+    data = minified.encode('utf-8')
+    name = os.path.splitext(os.path.basename(source))[0]
+    filename = '{}/{}.{}.min.css'.format(current_app.config['CSS_BUILD_DIR'], name,
+                                         hashlib.md5(data).hexdigest()[:10])
+    aliases_path = current_app.config['ASSET_ALIASES']
+    aliases = {}
+    if os.path.exists(aliases_path):
+        with open(aliases_path) as f:
+            aliases = json.load(f)
+    target = current_app.config['CSS_TARGET']
+    keep = {filename, aliases.get(target)}
+
+    os.makedirs(output, exist_ok=True)
+    for old in os.listdir(output):
+        if current_app.config['CSS_BUILD_DIR'] + '/' + old not in keep:
+            os.remove(os.path.join(output, old))
+    with open(os.path.join(current_app.static_folder, filename), 'wb') as f:
+        f.write(data)
+    aliases[target] = filename
+    with open(aliases_path, 'w') as f:
+        json.dump(aliases, f, indent=2, sort_keys=True)
+
+    sizes = [('compiled', len(compiled.encode('utf-8'))), ('purged', len(purged.encode('utf-8'))),
+             ('minified', len(data)), ('gzipped', len(gzip.compress(data)))]
+    click.echo(', '.join(label + ' ' + str(size) for label, size in sizes) + ' bytes')
+    click.echo(target + ' -> ' + filename)
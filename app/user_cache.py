@@ -0,0 +1,152 @@
+import threading
+from itertools import chain
+from cachetools import TTLCache
+from sqlalchemy import event
+from sqlalchemy.orm import Session, make_transient_to_detached
+from werkzeug.utils import import_string
+from app import db
+from app.models import User
+
+UNCACHED_COLUMNS = ('password_hash',)
+
+
+class LocalCache(object):
+    """Bounded per-process TTL/LRU cache with a cachelib-style interface."""
+
+    def __init__(self, maxsize=1024, ttl=60):
+        self.cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            return self.cache.get(key)
+
+    def set(self, key, value, timeout=None):
+        with self.lock:
+            self.cache[key] = value
+
+    def delete(self, key):
+        with self.lock:
+            self.cache.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.cache.clear()
+
+
+class UserCache(object):
+    """
+        Identity cache in front of the Flask-Login user loader. Column values
+        are cached rather than instances, and each hit is rebuilt into a
+        detached User and merged into the session without a query, so
+        relationships still lazy-load normally. The password hash is never
+        cached, since the backend may be shared over the network; on a hit it
+        is left unloaded and read from the database when check_password needs
+        it. The backend can be any object with get/set/delete (e.g. a
+        cachelib cache shared by workers).
+    """
+
+    def __init__(self, backend=None, ttl=60):
+        self.backend = backend
+        self.ttl = ttl
+        self.columns = [c.key for c in User.__mapper__.column_attrs
+                        if c.key not in UNCACHED_COLUMNS]
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def init_app(self, app):
+        self.backend = make_backend(app)
+        self.ttl = app.config['USER_CACHE_TTL']
+
+    def key(self, id):
+        return 'user:' + str(id)
+
+    def load(self, id):
+        try:
+            id = int(id)
+        except (TypeError, ValueError):
+            return None
+        values = self.backend.get(self.key(id))
+        if values is None:
+            self.count('misses')
+            user = db.session.get(User, id)
+            if user is not None:
+                self.backend.set(self.key(id),
+                    {c: getattr(user, c) for c in self.columns}, timeout=self.ttl)
+            return user
+        self.count('hits')
+        user = User(**values)
+        make_transient_to_detached(user)
+        return db.session.merge(user, load=False)
+
+    def count(self, counter):
+        with self.lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def invalidate(self, id):
+        self.count('invalidations')
+        self.backend.delete(self.key(id))
+
+    def clear(self):
+        self.count('invalidations')
+        self.backend.clear()
+
+    def stats(self):
+        with self.lock:
+            hits, misses, invalidations = self.hits, self.misses, self.invalidations
+        total = hits + misses
+        return {'hits': hits, 'misses': misses, 'invalidations': invalidations,
+                'hit_rate': round(hits / total, 3) if total else 0}
+
+
+def make_backend(app):
+    factory = app.config['USER_CACHE_BACKEND']
+    if factory:
+        return import_string(factory)(app)
+    return LocalCache(app.config['USER_CACHE_SIZE'], app.config['USER_CACHE_TTL'])
+
+
+user_cache = UserCache()
+
+
+@event.listens_for(Session, 'after_flush')
+def user_writes(session, flush_context):
+    ids = session.info.setdefault('changed_user_ids', set())
+    for obj in chain(session.dirty, session.deleted):
+        if isinstance(obj, User) and obj.id is not None:
+            ids.add(obj.id)
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def user_bulk_writes(state):
+    """
+        Bulk UPDATE/DELETE statements on the user table skip the flush.
+        Invalidate the ids they name - an 'id' in each parameter set (ORM
+        bulk update by primary key) or the user_ids execution option -
+        and clear the whole cache for anything else.
+    """
+    if not (state.is_update or state.is_delete):
+        return
+    table = getattr(state.statement, 'table', None)
+    if table is None or not table.compare(User.__table__):
+        return
+    ids = state.execution_options.get('user_ids')
+    if ids is None:
+        params = state.parameters if isinstance(state.parameters, list) else [state.parameters]
+        if params and all(p and 'id' in p for p in params):
+            ids = [p['id'] for p in params]
+    if ids is None:
+        state.session.info['clear_user_cache'] = True
+    else:
+        state.session.info.setdefault('changed_user_ids', set()).update(ids)
+
+
+@event.listens_for(Session, 'after_commit')
+@event.listens_for(Session, 'after_rollback')
+def user_writes_ended(session):
+    if session.info.pop('clear_user_cache', False):
+        user_cache.clear()
+    for id in session.info.pop('changed_user_ids', ()):
+        user_cache.invalidate(id)
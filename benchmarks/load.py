@@ -0,0 +1,244 @@
+"""
+    Concurrent load test against a local server, with no network dependencies.
+
+        python benchmarks/load.py --users 5000 --clients 16 --seconds 20 > before.json
+
+    The app runs in a child process (werkzeug's threaded server) on a
+    temporary SQLite database seeded with --users users. Mailjet and
+    hCaptcha are replaced by the local fakes. Each client thread signs in
+    as an admin and then requests random scenarios until time is up;
+    the first --warmup seconds are not recorded. Reports throughput,
+    status counts and p50/p95/p99 latency per scenario as JSON, tagged
+    with the git commit, so runs can be diffed across commits. Login time
+    is mostly PASSWORD_HASH_METHOD, which is read from the environment
+    like every other setting.
+"""
+import os
+import re
+import sys
+import json
+import random
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+from time import perf_counter
+from collections import Counter
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from fakes import mailjet, hcaptcha
+
+ADMIN = ('admin@example.com', 'benchmark-admin')
+MEMBER = ('member@example.com', 'benchmark-member')
+CSRF = re.compile(r'name="csrf_token" type="hidden" value="([^"]+)"')
+
+SERVER = '''
+import sys, random, logging
+sys.path.insert(0, {root!r})
+random.seed({seed})
+logging.getLogger('werkzeug').setLevel(logging.ERROR)
+from sqlalchemy import insert
+from werkzeug.serving import make_server
+from app import create_app, db
+from app.models import User
+
+app = create_app()
+
+with app.app_context():
+    db.create_all()
+    roles, statuses = ['parent', 'student', 'admin', None], ['active', 'inactive', None]
+    rows = [dict(first_name='User{{}}'.format(i), last_name='Bench', phone='555-{{:04d}}'.format(i),
+                 email='user{{}}@example.com'.format(i), location=random.choice(['North', 'South']),
+                 role=random.choice(roles), status=random.choice(statuses))
+            for i in range({users})]
+    for start in range(0, len(rows), 1000):
+        db.session.execute(insert(User), rows[start:start + 1000])
+    for email, password, is_admin in [({admin!r}, {admin_password!r}, True),
+                                      ({member!r}, {member_password!r}, False)]:
+        user = User(first_name='Bench', email=email, is_admin=is_admin, is_verified=True)
+        user.set_password(password)
+        db.session.add(user)
+    db.session.commit()
+
+server = make_server('127.0.0.1', 0, app, threaded=True)
+print(server.server_port, flush=True)
+sys.stdout = sys.stderr
+server.serve_forever()
+'''
+
+
+class Client(object):
+    """
+        One simulated visitor: an admin session for the directory pages
+        and an anonymous session for the public pages and form posts.
+    """
+
+    def __init__(self, base, user_ids):
+        self.base = base
+        self.user_ids = user_ids
+        self.admin = requests.Session()
+        self.anonymous = requests.Session()
+        self.admin_token = self.csrf_token(self.admin)
+        self.sign_in(self.admin, self.admin_token, *ADMIN).raise_for_status()
+        self.token = self.csrf_token(self.anonymous)
+
+    def csrf_token(self, session):
+        return CSRF.search(session.get(self.base + '/signin').text).group(1)
+
+    def sign_in(self, session, token, email, password):
+        return session.post(self.base + '/login', allow_redirects=False,
+                            data={'csrf_token': token, 'email': email, 'password': password})
+
+    def home(self):
+        return self.anonymous.get(self.base + '/')
+
+    def about(self):
+        return self.anonymous.get(self.base + '/about')
+
+    def signin(self):
+        return self.anonymous.get(self.base + '/signin')
+
+    def login(self):
+        response = self.sign_in(self.anonymous, self.token, *MEMBER)
+        self.anonymous.get(self.base + '/logout', allow_redirects=False)
+        return response
+
+    def contact(self):
+        return self.anonymous.post(self.base + '/', allow_redirects=False, data={
+            'csrf_token': self.token, 'first_name': 'Load', 'email': 'load@example.com',
+            'subject': 'Benchmark', 'message': 'Hello', 'h-captcha-response': 'ok'})
+
+    def users(self):
+        return self.admin.get(self.base + '/users')
+
+    def edit_user(self):
+        return self.admin.get(self.base + '/edit-user/' + str(random.choice(self.user_ids)))
+
+    def sitemap(self):
+        return self.anonymous.get(self.base + '/sitemap.xml')
+
+
+SCENARIOS = ['home', 'about', 'signin', 'login', 'contact', 'users', 'edit_user', 'sitemap']
+
+
+def client_loop(client, scenarios, warmup_end, deadline, results):
+    while True:
+        name = random.choice(scenarios)
+        start = perf_counter()
+        if start >= deadline:
+            return
+        try:
+            status = getattr(client, name)().status_code
+        except requests.RequestException:
+            status = 'error'
+        if start >= warmup_end:
+            results[name].append((perf_counter() - start, status))
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(len(values) * p))] * 1000, 2)
+
+
+def summary(samples, seconds):
+    latencies = [latency for latency, status in samples]
+    return {'requests': len(samples),
+            'per_second': round(len(samples) / seconds, 1),
+            'statuses': dict(Counter(str(status) for latency, status in samples)),
+            'p50_ms': percentile(latencies, 0.5),
+            'p95_ms': percentile(latencies, 0.95),
+            'p99_ms': percentile(latencies, 0.99)}
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, check=True,
+                              capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def start_server(tmp, users, seed, env, log):
+    script = SERVER.format(root=ROOT, users=users, seed=seed, admin=ADMIN[0],
+                           admin_password=ADMIN[1], member=MEMBER[0], member_password=MEMBER[1])
+    process = subprocess.Popen([sys.executable, '-c', script], env=env, cwd=tmp,
+                               stdout=subprocess.PIPE, stderr=log, text=True)
+    port = process.stdout.readline().strip()
+    if not port:
+        process.wait()
+        raise SystemExit('Server failed to start (exit status {}).'.format(process.returncode))
+    return process, 'http://127.0.0.1:' + port
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--warmup', type=float, default=2)
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS),
+                        help='comma-separated subset of: ' + ', '.join(SCENARIOS))
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--server-log', help='write the server\'s output here')
+    args = parser.parse_args()
+    scenarios = [s for s in args.scenarios.split(',') if s]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error('unknown scenarios: ' + ', '.join(sorted(unknown)))
+    random.seed(args.seed)
+
+    mail = mailjet.serve_in_thread()
+    captcha = hcaptcha.serve_in_thread()
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, PYTHONHASHSEED=str(args.seed))
+        env.update(MAILJET_KEY='benchmark', MAILJET_SECRET='benchmark', MAILJET_API_URL=mail.url,
+                   HCAPTCHA_SITE_KEY='benchmark', HCAPTCHA_SECRET_KEY='benchmark',
+                   HCAPTCHA_VERIFY_URL=captcha.url, RATELIMIT_ENABLED='false',
+                   JINJA_CACHE_DIR=os.path.join(tmp, 'jinja'))
+        env.setdefault('SECRET_KEY', 'benchmark')
+        env.setdefault('HELLO_EMAIL', 'hello@example.com')
+        env.setdefault('MAIL_USERNAME', 'hello@example.com')
+        env.setdefault('DATABASE_URL', 'sqlite:///' + os.path.join(tmp, 'app.db'))
+        log = open(args.server_log, 'w') if args.server_log else subprocess.DEVNULL
+        server, base = start_server(tmp, args.users, args.seed, env, log)
+        try:
+            user_ids = list(range(1, args.users + 1)) or [args.users + 1]
+            clients = [Client(base, user_ids) for i in range(args.clients)]
+            results = {name: [] for name in scenarios}
+            warmup_end = perf_counter() + args.warmup
+            deadline = warmup_end + args.seconds
+            threads = [threading.Thread(target=client_loop,
+                                        args=(client, scenarios, warmup_end, deadline, results))
+                       for client in clients]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            server.terminate()
+            server.wait()
+            if args.server_log:
+                log.close()
+
+    everything = [sample for samples in results.values() for sample in samples]
+    print(json.dumps({
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'users': args.users,
+        'clients': args.clients,
+        'seconds': args.seconds,
+        'total': summary(everything, args.seconds),
+        'scenarios': {name: summary(samples, args.seconds) for name, samples in results.items()},
+        'emails_sent': len(mail.sent),
+        'captcha_verified': captcha.verified,
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+"""
+    Password hashing throughput for the configured PASSWORD_HASH_METHOD.
+
+        python benchmarks/password_hash.py --seconds 5 --workers 4
+
+    Reports hashes/sec on one core and across a process pool, plus the
+    per-core rate, so hash cost can be tuned against login capacity.
+"""
+import os
+import sys
+import json
+import argparse
+from time import perf_counter
+from concurrent.futures import ProcessPoolExecutor
+from werkzeug.security import generate_password_hash
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import Config
+
+
+def hash_for(seconds, method):
+    count = 0
+    start = perf_counter()
+    while perf_counter() - start < seconds:
+        generate_password_hash('correct horse battery staple', method)
+        count += 1
+    return count, perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--method', default=Config.PASSWORD_HASH_METHOD)
+    parser.add_argument('--seconds', type=float, default=3)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    count, elapsed = hash_for(args.seconds, args.method)
+    single = count / elapsed
+
+    with ProcessPoolExecutor(args.workers) as pool:
+        results = list(pool.map(hash_for, [args.seconds] * args.workers,
+                                [args.method] * args.workers))
+    pooled = sum(c / e for c, e in results)
+
+    print(json.dumps({
+        'method': args.method,
+        'single_core_per_second': round(single, 2),
+        'single_hash_ms': round(1000 / single, 2),
+        'workers': args.workers,
+        'pool_per_second': round(pooled, 2),
+        'pool_per_core_per_second': round(pooled / args.workers, 2),
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
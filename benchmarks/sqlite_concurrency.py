@@ -0,0 +1,120 @@
+"""
+    Concurrent reads and writes against SQLite, default vs production pragmas.
+
+        python benchmarks/sqlite_concurrency.py --readers 8 --writers 2 --seconds 5
+
+    Writers update user.last_viewed and commit, like the per-request
+    last-seen flush; readers load users by id and count the directory.
+    Each mode runs on a fresh temporary database. Reports operations per
+    second, p50/p95 latency and 'database is locked' errors.
+"""
+import os
+import sys
+import json
+import random
+import argparse
+import tempfile
+import threading
+from time import perf_counter
+from datetime import datetime
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.exc import OperationalError
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import Config
+
+USERS = 2000
+
+
+def make_engine(path, pragmas, pool_size):
+    engine = create_engine('sqlite:///' + path, pool_size=pool_size, max_overflow=0)
+
+    @event.listens_for(engine, 'connect')
+    def connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute('PRAGMA {}={}'.format(name, value))
+        cursor.close()
+
+    with engine.begin() as conn:
+        conn.execute(text('CREATE TABLE user (id INTEGER PRIMARY KEY, email VARCHAR(64), '
+                          'status VARCHAR(24), role VARCHAR(24), last_viewed DATETIME)'))
+        conn.execute(text('CREATE INDEX ix_user_role ON user (role)'))
+        conn.execute(text('INSERT INTO user (id, email, status, role, last_viewed) '
+                          'VALUES (:id, :email, :status, :role, :now)'),
+                     [{'id': i, 'email': 'user{}@example.com'.format(i), 'status': 'active',
+                       'role': random.choice(['Parent', 'Student', 'Tutor']),
+                       'now': datetime.utcnow()} for i in range(1, USERS + 1)])
+    return engine
+
+
+def read(conn):
+    conn.execute(text('SELECT * FROM user WHERE id = :id'), {'id': random.randint(1, USERS)}).all()
+    conn.execute(text('SELECT role, count(*) FROM user GROUP BY role')).all()
+
+
+def write(conn):
+    conn.execute(text('UPDATE user SET last_viewed = :now WHERE id = :id'),
+                 {'now': datetime.utcnow(), 'id': random.randint(1, USERS)})
+    conn.commit()
+
+
+def worker(engine, op, deadline, latencies, errors):
+    with engine.connect() as conn:
+        while perf_counter() < deadline:
+            start = perf_counter()
+            try:
+                op(conn)
+                conn.rollback()
+            except OperationalError:
+                conn.rollback()
+                errors.append(1)
+                continue
+            latencies.append(perf_counter() - start)
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(len(values) * p))] * 1000, 2)
+
+
+def run(pragmas, readers, writers, seconds):
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = make_engine(os.path.join(tmp, 'bench.db'), pragmas, readers + writers)
+        results = {'read': ([], []), 'write': ([], [])}
+        deadline = perf_counter() + seconds
+        threads = [threading.Thread(target=worker, args=(engine, op, deadline) + results[name])
+                   for name, op, count in [('read', read, readers), ('write', write, writers)]
+                   for i in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        engine.dispose()
+    return {name: {'per_second': round(len(latencies) / seconds, 1),
+                   'p50_ms': percentile(latencies, 0.5),
+                   'p95_ms': percentile(latencies, 0.95),
+                   'locked_errors': len(errors)}
+            for name, (latencies, errors) in results.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--writers', type=int, default=2)
+    parser.add_argument('--seconds', type=float, default=5)
+    args = parser.parse_args()
+
+    print(json.dumps({
+        'readers': args.readers,
+        'writers': args.writers,
+        'default': run({}, args.readers, args.writers, args.seconds),
+        'production': run(Config.SQLITE_PRODUCTION_PRAGMAS, args.readers, args.writers,
+                          args.seconds),
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
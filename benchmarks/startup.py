@@ -0,0 +1,76 @@
+"""
+    Cold start time: interpreter launch to the first response.
+
+        python benchmarks/startup.py --runs 10 --path /about
+
+    Each run is a fresh Python process that imports the app and serves one
+    request through the test client, so it approximates worker boot and
+    autoscale latency. Reports median and worst times for the import, the
+    first request, and the whole process.
+"""
+import os
+import sys
+import json
+import argparse
+import tempfile
+import subprocess
+from time import perf_counter
+from statistics import median
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = '''
+import sys, json
+from time import perf_counter
+start = perf_counter()
+sys.path.insert(0, {root!r})
+from app import create_app
+app = create_app()
+imported = perf_counter()
+response = app.test_client().get({path!r})
+served = perf_counter()
+print(json.dumps({{'status': response.status_code,
+                  'import_ms': (imported - start) * 1000,
+                  'first_response_ms': (served - imported) * 1000}}))
+'''
+
+
+def run_once(path, env):
+    start = perf_counter()
+    output = subprocess.run([sys.executable, '-c', CHILD.format(root=ROOT, path=path)],
+                            env=env, cwd=tempfile.gettempdir(), check=True,
+                            capture_output=True, text=True).stdout
+    result = json.loads(output.strip().splitlines()[-1])
+    result['process_ms'] = (perf_counter() - start) * 1000
+    return result
+
+
+def summary(values):
+    return {'median': round(median(values), 1), 'max': round(max(values), 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--path', default='/about')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ)
+        env.setdefault('SECRET_KEY', 'benchmark')
+        env.setdefault('DATABASE_URL', 'sqlite:///' + os.path.join(tmp, 'app.db'))
+        run_once(args.path, env)
+        results = [run_once(args.path, env) for i in range(args.runs)]
+
+    print(json.dumps({
+        'path': args.path,
+        'runs': args.runs,
+        'status': results[-1]['status'],
+        'import_ms': summary([r['import_ms'] for r in results]),
+        'first_response_ms': summary([r['first_response_ms'] for r in results]),
+        'process_ms': summary([r['process_ms'] for r in results]),
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -9,11 +9,103 @@ class Config(object):
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or \
         'sqlite:///' + os.path.join(basedir, 'app.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    DATABASE_MODE = os.environ.get('DATABASE_MODE') or 'default'
+    SQLITE_PRODUCTION_PRAGMAS = {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': int(os.environ.get('SQLITE_BUSY_TIMEOUT') or 5000),
+        'mmap_size': int(os.environ.get('SQLITE_MMAP_SIZE') or 268435456),
+        'cache_size': int(os.environ.get('SQLITE_CACHE_SIZE') or -65536),
+    }
+    SQLITE_PRAGMAS = SQLITE_PRODUCTION_PRAGMAS if DATABASE_MODE == 'production' else {}
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'pool_size': int(os.environ.get('DB_POOL_SIZE') or 5),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW') or 10),
+        'pool_timeout': int(os.environ.get('DB_POOL_TIMEOUT') or 30),
+        'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE') or 1800),
+        'pool_pre_ping': True,
+    } if SQLALCHEMY_DATABASE_URI.startswith('postgres') else {}
     MAIL_USERNAME = os.environ.get('MAIL_USERNAME')
     HCAPTCHA_SITE_KEY = os.environ.get('HCAPTCHA_SITE_KEY')
     HCAPTCHA_SECRET_KEY = os.environ.get('HCAPTCHA_SECRET_KEY')
+    HCAPTCHA_VERIFY_URL = os.environ.get('HCAPTCHA_VERIFY_URL') or 'https://hcaptcha.com/siteverify'
+    HCAPTCHA_TIMEOUT = float(os.environ.get('HCAPTCHA_TIMEOUT') or 2)
+    HCAPTCHA_FAIL_OPEN = (os.environ.get('HCAPTCHA_FAIL_OPEN') or 'false').lower() == 'true'
+    HCAPTCHA_BREAKER_THRESHOLD = int(os.environ.get('HCAPTCHA_BREAKER_THRESHOLD') or 5)
+    HCAPTCHA_BREAKER_RESET = int(os.environ.get('HCAPTCHA_BREAKER_RESET') or 30)
     MAILJET_KEY = os.environ.get('MAILJET_KEY')
     MAILJET_SECRET = os.environ.get('MAILJET_SECRET')
+    MAILJET_API_URL = os.environ.get('MAILJET_API_URL')
+    MAILJET_TIMEOUT = int(os.environ.get('MAILJET_TIMEOUT') or 10)
+    MAILJET_POOL_SIZE = int(os.environ.get('MAILJET_POOL_SIZE') or 10)
+    MAILJET_BATCH_SIZE = int(os.environ.get('MAILJET_BATCH_SIZE') or 50)
     ADMINS = [os.environ.get('ADMINS')]
     HELLO_EMAIL = os.environ.get('HELLO_EMAIL')
     PHONE = os.environ.get('PHONE')
+    ASSET_MANIFEST = os.environ.get('ASSET_MANIFEST') or \
+        os.path.join(basedir, 'asset-manifest.json')
+    ASSET_MANIFEST_EXCLUDE = ['scss']
+    ASSET_PREHASHED = ['img/variants', 'dist']
+    ASSET_ALIASES = os.path.join(basedir, 'asset-aliases.json')
+    ASSET_MAX_AGE = int(os.environ.get('ASSET_MAX_AGE') or 31536000)
+    LAST_SEEN_RESOLUTION = int(os.environ.get('LAST_SEEN_RESOLUTION') or 60)
+    LAST_SEEN_FLUSH_INTERVAL = int(os.environ.get('LAST_SEEN_FLUSH_INTERVAL') or 60)
+    OUTBOX_INLINE_WORKER = (os.environ.get('OUTBOX_INLINE_WORKER') or 'true').lower() == 'true'
+    OUTBOX_WORKERS = int(os.environ.get('OUTBOX_WORKERS') or 4)
+    OUTBOX_BATCH_SIZE = int(os.environ.get('OUTBOX_BATCH_SIZE') or 20)
+    OUTBOX_MIN_CHUNK = int(os.environ.get('OUTBOX_MIN_CHUNK') or 10)
+    OUTBOX_POLL_INTERVAL = int(os.environ.get('OUTBOX_POLL_INTERVAL') or 5)
+    OUTBOX_MAX_ATTEMPTS = int(os.environ.get('OUTBOX_MAX_ATTEMPTS') or 6)
+    OUTBOX_BACKOFF = int(os.environ.get('OUTBOX_BACKOFF') or 30)
+    BROADCAST_MAX_FAILURES = int(os.environ.get('BROADCAST_MAX_FAILURES') or 3)
+    USERS_PER_PAGE = int(os.environ.get('USERS_PER_PAGE') or 100)
+    USER_SEARCH_PER_PAGE = int(os.environ.get('USER_SEARCH_PER_PAGE') or 25)
+    PARENT_CHOICES_TTL = int(os.environ.get('PARENT_CHOICES_TTL') or 300)
+    PARENT_TYPEAHEAD_THRESHOLD = int(os.environ.get('PARENT_TYPEAHEAD_THRESHOLD') or 200)
+    USER_CACHE_BACKEND = os.environ.get('USER_CACHE_BACKEND')
+    USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE') or 1024)
+    USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL') or 60)
+    PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD') or 'scrypt:32768:8:1'
+    PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS') or 2)
+    PASSWORD_HASH_TIMEOUT = int(os.environ.get('PASSWORD_HASH_TIMEOUT') or 10)
+    SITEMAP_HOSTS = [h for h in (os.environ.get('SITEMAP_HOSTS') or '').split(',') if h]
+    SITEMAP_MAX_AGE = int(os.environ.get('SITEMAP_MAX_AGE') or 3600)
+    PAGE_CACHE_ENABLED = (os.environ.get('PAGE_CACHE_ENABLED') or 'false').lower() == 'true'
+    PAGE_CACHE_DIR = os.environ.get('PAGE_CACHE_DIR')
+    PAGE_CACHE_SIZE = int(os.environ.get('PAGE_CACHE_SIZE') or 512)
+    PAGE_CACHE_TTL = int(os.environ.get('PAGE_CACHE_TTL') or 300)
+    COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE') or 1024)
+    COMPRESS_LEVEL = 6
+    COMPRESS_BR_QUALITY = 5
+    COMPRESS_MIMETYPES = ['text/html', 'text/css', 'text/plain', 'text/xml', 'text/javascript',
+        'application/javascript', 'application/json', 'application/xml', 'image/svg+xml']
+    IMAGE_VARIANTS_INDEX = os.path.join(basedir, 'image-variants.json')
+    IMAGE_SOURCES = ['img']
+    IMAGE_SOURCES_EXCLUDE = ['img/favicons', 'img/variants']
+    IMAGE_VARIANTS_DIR = 'img/variants'
+    IMAGE_WIDTHS = [320, 640, 960, 1280, 1920]
+    IMAGE_FORMATS = ['avif', 'webp', 'jpeg']
+    CSS_SOURCE = 'css/custom.scss'
+    CSS_TARGET = 'css/custom.css'
+    CSS_BUILD_DIR = 'dist'
+    CSS_PURGE_CONTENT = ['templates/**/*.html', 'static/js/menu.js', '*.py']
+    CSS_PURGE_SAFELIST = ['show', 'fade', 'collapsing', 'modal-backdrop', 'modal-open', 'modal-static']
+    CRITICAL_CSS_ENABLED = (os.environ.get('CRITICAL_CSS_ENABLED') or 'true').lower() == 'true'
+    CRITICAL_CSS_INDEX = os.path.join(basedir, 'critical-css.json')
+    CRITICAL_CSS_FOLD = int(os.environ.get('CRITICAL_CSS_FOLD') or 6000)
+    CRITICAL_CSS_BUDGET = int(os.environ.get('CRITICAL_CSS_BUDGET') or 14000)
+    JINJA_CACHE_DIR = os.environ.get('JINJA_CACHE_DIR') or os.path.join(basedir, '.jinja-cache')
+    PREWARM = (os.environ.get('PREWARM') or 'false').lower() == 'true'
+    RATELIMIT_ENABLED = (os.environ.get('RATELIMIT_ENABLED') or 'true').lower() == 'true'
+    RATELIMIT_STORAGE_URI = os.environ.get('RATELIMIT_STORAGE_URI') or 'memory://'
+    RATELIMIT_FORM_IP = os.environ.get('RATELIMIT_FORM_IP') or '10 per minute;50 per hour'
+    RATELIMIT_FORM_EMAIL = os.environ.get('RATELIMIT_FORM_EMAIL') or '5 per 15 minutes;20 per day'
+    FORM_CONCURRENCY = int(os.environ.get('FORM_CONCURRENCY') or 8)
+    FORM_CONCURRENCY_WAIT = float(os.environ.get('FORM_CONCURRENCY_WAIT') or 0.5)
+    FORM_RETRY_AFTER = int(os.environ.get('FORM_RETRY_AFTER') or 10)
+    METRICS_ENABLED = (os.environ.get('METRICS_ENABLED') or 'true').lower() == 'true'
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+    SLOW_QUERY_MS = int(os.environ.get('SLOW_QUERY_MS') or 250)
+    SLOW_QUERY_EXPLAIN = (os.environ.get('SLOW_QUERY_EXPLAIN') or 'true').lower() == 'true'
+    N_PLUS_ONE_THRESHOLD = int(os.environ.get('N_PLUS_ONE_THRESHOLD') or 10)
+    N_PLUS_ONE_RAISE = (os.environ.get('N_PLUS_ONE_RAISE') or 'false').lower() == 'true'
@@ -0,0 +1,104 @@
+"""
+    Local stand-in for the hCaptcha siteverify API, for exercising the
+    contact and password reset forms offline. Point HCAPTCHA_VERIFY_URL at
+    it and post any h-captcha-response token, e.g.
+
+        python -m fakes.hcaptcha --port 8026 --latency 0.05
+        HCAPTCHA_SITE_KEY=test HCAPTCHA_SECRET_KEY=test \\
+            HCAPTCHA_VERIFY_URL=http://127.0.0.1:8026/siteverify flask run
+
+    Tokens starting with --reject-prefix fail verification, and
+    --fail-rate answers that share of requests with a 503.
+"""
+import json
+import time
+import random
+import argparse
+import threading
+from datetime import datetime
+from urllib.parse import parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeHCaptchaHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        with self.server.lock:
+            self.server.requests += 1
+        if self.path.rstrip('/') != '/siteverify':
+            return self.reply(404, {'success': False, 'error-codes': ['not-found']})
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        if random.random() < self.server.fail_rate:
+            return self.reply(503, {'success': False, 'error-codes': ['internal-error']})
+
+        form = {k: v[0] for k, v in parse_qs(body.decode()).items()}
+        token = form.get('response', '')
+        if not form.get('secret'):
+            return self.reply(200, {'success': False, 'error-codes': ['missing-input-secret']})
+        if not token or token.startswith(self.server.reject_prefix):
+            return self.reply(200, {'success': False, 'error-codes': ['invalid-input-response']})
+        with self.server.lock:
+            self.server.verified += 1
+        self.reply(200, {'success': True, 'hostname': 'localhost',
+                         'challenge_ts': datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ')})
+
+    def reply(self, status, data):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        try:
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # the client gave up waiting
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+
+class FakeHCaptchaServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, fail_rate=0.0, latency=0.0, reject_prefix='bad',
+                 verbose=False):
+        ThreadingHTTPServer.__init__(self, address, FakeHCaptchaHandler)
+        self.fail_rate = fail_rate
+        self.latency = latency
+        self.reject_prefix = reject_prefix
+        self.verbose = verbose
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.verified = 0
+
+    @property
+    def url(self):
+        return 'http://%s:%d/siteverify' % self.server_address[:2]
+
+
+def serve_in_thread(host='127.0.0.1', port=0, **kwargs):
+    """Start a server on a background thread and return it."""
+    server = FakeHCaptchaServer((host, port), **kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Fake hCaptcha siteverify API')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8026)
+    parser.add_argument('--fail-rate', type=float, default=0.0)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--reject-prefix', default='bad')
+    args = parser.parse_args()
+    server = FakeHCaptchaServer((args.host, args.port), fail_rate=args.fail_rate,
+        latency=args.latency, reject_prefix=args.reject_prefix, verbose=True)
+    print('Fake hCaptcha listening on ' + server.url)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,107 @@
+"""
+    Local stand-in for the Mailjet v3.1 Send API, for exercising the email
+    outbox offline. Point MAILJET_API_URL at it, e.g.
+
+        python -m fakes.mailjet --port 8025 --fail-rate 0.2
+        MAILJET_API_URL=http://127.0.0.1:8025/ flask run
+
+    Recipients at --reject-domain get a per-message 400 error, and
+    --fail-rate answers that share of requests with a 503.
+"""
+import json
+import time
+import uuid
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeMailjetHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        with self.server.lock:
+            self.server.requests += 1
+        if self.path.rstrip('/') != '/v3.1/send':
+            return self.reply(404, {'ErrorMessage': 'Not found'})
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        if random.random() < self.server.fail_rate:
+            return self.reply(503, {'ErrorMessage': 'Service unavailable'})
+        try:
+            messages = json.loads(body)['Messages']
+        except (ValueError, KeyError):
+            return self.reply(400, {'ErrorMessage': 'Malformed request'})
+
+        results = [self.server.accept(m) for m in messages]
+        status = 200 if all(r['Status'] == 'success' for r in results) else 400
+        self.reply(status, {'Messages': results})
+
+    def reply(self, status, data):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+
+class FakeMailjetServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, fail_rate=0.0, latency=0.0,
+                 reject_domain='invalid', verbose=False):
+        ThreadingHTTPServer.__init__(self, address, FakeMailjetHandler)
+        self.fail_rate = fail_rate
+        self.latency = latency
+        self.reject_domain = reject_domain
+        self.verbose = verbose
+        self.lock = threading.Lock()
+        self.sent = []
+        self.requests = 0
+
+    @property
+    def url(self):
+        return 'http://%s:%d/' % self.server_address[:2]
+
+    def accept(self, message):
+        to = [r.get('Email', '') for r in message.get('To', [])]
+        if not to or any(e.endswith('@' + self.reject_domain) for e in to):
+            return {'Status': 'error', 'Errors': [{
+                'ErrorCode': 'mj-0013', 'StatusCode': 400,
+                'ErrorMessage': 'Recipient rejected', 'ErrorRelatedTo': ['To']}]}
+        with self.lock:
+            self.sent.append(message)
+        return {'Status': 'success', 'To': [{
+            'Email': e, 'MessageUUID': str(uuid.uuid4()),
+            'MessageID': random.getrandbits(50)} for e in to]}
+
+
+def serve_in_thread(host='127.0.0.1', port=0, **kwargs):
+    """Start a server on a background thread and return it."""
+    server = FakeMailjetServer((host, port), **kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Fake Mailjet v3.1 Send API')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8025)
+    parser.add_argument('--fail-rate', type=float, default=0.0)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--reject-domain', default='invalid')
+    args = parser.parse_args()
+    server = FakeMailjetServer((args.host, args.port), fail_rate=args.fail_rate,
+        latency=args.latency, reject_domain=args.reject_domain, verbose=True)
+    print('Fake Mailjet listening on ' + server.url)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,60 @@
+"""user search index
+
+Revision ID: db63148fc0fb
+Revises: 798bb73a7b06
+Create Date: 2026-10-18 07:52:29.968297
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'db63148fc0fb'
+down_revision = '798bb73a7b06'
+branch_labels = None
+depends_on = None
+
+# A copy of app.search's DDL as of this revision, so the migration doesn't
+# change (or import the app) when the search code does.
+SEARCH_INDEX_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS user_search USING fts5(
+        first_name, last_name, email, phone, location,
+        content='user', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3')""",
+    """CREATE TRIGGER IF NOT EXISTS user_search_insert AFTER INSERT ON user BEGIN
+        INSERT INTO user_search(rowid, first_name, last_name, email, phone, location)
+        VALUES (new.id, new.first_name, new.last_name, new.email, new.phone, new.location);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS user_search_delete AFTER DELETE ON user BEGIN
+        INSERT INTO user_search(user_search, rowid, first_name, last_name, email, phone, location)
+        VALUES ('delete', old.id, old.first_name, old.last_name, old.email, old.phone, old.location);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS user_search_update
+        AFTER UPDATE OF first_name, last_name, email, phone, location ON user BEGIN
+        INSERT INTO user_search(user_search, rowid, first_name, last_name, email, phone, location)
+        VALUES ('delete', old.id, old.first_name, old.last_name, old.email, old.phone, old.location);
+        INSERT INTO user_search(rowid, first_name, last_name, email, phone, location)
+        VALUES (new.id, new.first_name, new.last_name, new.email, new.phone, new.location);
+    END""",
+]
+DROP_SEARCH_INDEX_DDL = [
+    'DROP TRIGGER IF EXISTS user_search_update',
+    'DROP TRIGGER IF EXISTS user_search_delete',
+    'DROP TRIGGER IF EXISTS user_search_insert',
+    'DROP TABLE IF EXISTS user_search',
+]
+
+
+def upgrade():
+    # FTS5 index for user search; other databases fall back to LIKE
+    if op.get_bind().dialect.name == 'sqlite':
+        for statement in SEARCH_INDEX_DDL:
+            op.execute(statement)
+        op.execute("INSERT INTO user_search(user_search) VALUES ('rebuild')")
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'sqlite':
+        for statement in DROP_SEARCH_INDEX_DDL:
+            op.execute(statement)
@@ -0,0 +1,28 @@
+"""user directory keyset indexes
+
+Revision ID: 8d41e6b2c5a7
+Revises: 3f0c2a9d7e41
+Create Date: 2026-10-18 08:20:00.204815
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8d41e6b2c5a7'
+down_revision = '3f0c2a9d7e41'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_user_directory', 'user',
+                    ['status', 'role', sa.text("coalesce(first_name, '')"), 'id'], unique=False)
+    op.create_index('ix_user_directory_name', 'user',
+                    [sa.text("coalesce(first_name, '')"), 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_user_directory_name', table_name='user')
+    op.drop_index('ix_user_directory', table_name='user')
@@ -0,0 +1,24 @@
+"""user email lower index
+
+Revision ID: 5b7e9c1d2f60
+Revises: 8d41e6b2c5a7
+Create Date: 2026-10-18 08:30:00.771342
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5b7e9c1d2f60'
+down_revision = '8d41e6b2c5a7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_user_email_lower', 'user', [sa.text('lower(email)')], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_user_email_lower', table_name='user')